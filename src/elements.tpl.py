@@ -5,17 +5,26 @@ __version__ = "___VERSION___"
 
 # imports  {{{1
 import argparse
+import contextlib
+import fcntl
+import glob
+import hashlib
 import io
+import json
 import os
 import re
 import shlex
+import shutil
 import stat
 import subprocess
 import sys
 import tarfile
 import tempfile
+import threading
+import time
 
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import *
 
 
@@ -25,6 +34,13 @@ TRUTHY = ("true", "1", "yes")
 FALSY = ("false", "0", "no", "")
 BOOLS = TRUTHY + FALSY
 
+# appended to the output filename to get the build manifest's filename
+MANIFEST_SUFFIX = ".elements-manifest"
+
+# held while writing to stderr, so that lines from parallel build stages
+# do not get mixed together
+OUTPUT_LOCK = threading.Lock()
+
 
 class ElementError(RuntimeError):  #{{{1
  message: Optional[str]
@@ -51,22 +67,223 @@ def main(argv):  #{{{1
   if isinstance(options, int):
    return options
   
-  if is_binary_file(options.def_):
-   raise ElementError("`%s` is not a definition file" % options.def_)
+  if options.check or options.emit_loader:
+   return _main_check(options)
   
-  if os.path.exists(options.output) and not is_binary_file(options.output):
-   raise ElementError("`%s` exists but is a text file" % options.output)
+  if options.output_dir:
+   return _main_batch(options)
   
-  with open(options.def_, "rb") as def_:
-   el = Element(def_.read())
+  cache = None
+  if not options.no_cache:
+   cache = BuildCache(options.cache_dir or BuildCache.default_path())
   
-  el.build(options.output, os.path.dirname(options.def_) or ".",
-           print_status=True, from_filename=options.def_)
+  profile = BuildProfile() if options.profile else None
+  profile_stdout = reserve_stdout() if options.profile == "-" else None
+  try:
+   build_def(options.def_, options.output, cache=cache, force=options.force,
+             profile=profile)
+  finally:
+   if profile:
+    write_profile(options.profile, profile.report(), profile_stdout)
  except RuntimeError as error:
   print("elements: error: " + str(error), file=sys.stderr)
   return 1
 
 
+def _main_batch(options) -> int:  #{{{1
+ # Builds every def in `options.defs` into `options.output_dir`, with up to
+ # `options.jobs` builds at a time.  The builds share a build cache (a
+ # temporary one with --no-cache), so the bootstrap filesystem and base
+ # image layers are only made once.
+ builds = batch_outputs(options.defs, options.output_dir)
+ 
+ os.makedirs(options.output_dir, exist_ok=True)
+ profile_stdout = reserve_stdout() if options.profile == "-" else None
+ 
+ with contextlib.ExitStack() as stack:
+  if options.no_cache:
+   cache_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix=".elements-cache."))
+  else:
+   cache_dir = options.cache_dir or BuildCache.default_path()
+  cache = BuildCache(cache_dir)
+  
+  profiles: Dict[str, Optional[BuildProfile]] = OrderedDict((output, None) for output in builds)
+  
+  def _build(output: str, def_file: str) -> Tuple[str, Optional[str], float]:
+   start = time.monotonic()
+   profile = profiles[output] = BuildProfile() if options.profile else None
+   try:
+    built = build_def(def_file, output, cache=cache, force=options.force, profile=profile,
+                      prefix="[%s] " % os.path.basename(output) if options.jobs > 1 else "")
+    result, error = "ok" if built else "skip", None
+   except Exception as exc:
+    # any error fails only this build
+    if isinstance(exc, RuntimeError):
+     error = str(exc)
+    elif isinstance(exc, OSError) and exc.strerror:
+     error = "%s%s" % (exc.strerror, ": `%s`" % exc.filename if exc.filename else "")
+    else:
+     error = "%s: %s" % (type(exc).__name__, exc)
+    result = "FAILED"
+    with OUTPUT_LOCK:
+     print("elements: error: %s: %s" % (def_file, error), file=sys.stderr)
+   return result, error, time.monotonic() - start
+  
+  with ThreadPoolExecutor(max_workers=options.jobs) as executor:
+   results = [(output, def_file, executor.submit(_build, output, def_file))
+              for output, def_file in builds.items()]
+  
+  if options.profile:
+   write_profile(options.profile, [profile.report() for profile in profiles.values() if profile],
+                 profile_stdout)
+ 
+ failed = skipped = 0
+ print("", file=sys.stderr)
+ for output, def_file, future in results:
+  result, error, seconds = future.result()
+  failed += 1 if error else 0
+  skipped += 1 if result == "skip" else 0
+  print("%-6s %8.1fs  %s -> %s%s" % (result, seconds,
+                                      def_file, output,
+                                      ": " + error.splitlines()[0] if error else ""),
+        file=sys.stderr)
+ print("%d built, %d up to date, %d failed"
+       % (len(results) - skipped - failed, skipped, failed), file=sys.stderr)
+ 
+ return 1 if failed else 0
+
+
+def _main_check(options) -> int:  #{{{1
+ # Parses and compiles every def in `options.defs` without building them,
+ # printing any errors.  With --emit-loader, each def's loader script is
+ # written to `options.output_dir`, or to stdout if there is only one def.
+ loaders: List[Tuple[str, str]]  # (output, def)
+ if options.output_dir and options.emit_loader:
+  loaders = list(batch_outputs(options.defs, options.output_dir, ".sh").items())
+  os.makedirs(options.output_dir, exist_ok=True)
+ else:
+  loaders = [("-", i) for i in find_defs(options.defs)]
+  if options.emit_loader and len(loaders) > 1:
+   raise ElementError("--emit-loader needs --output-dir for more than one definition file")
+ 
+ failed = 0
+ for output, def_file in loaders:
+  try:
+   loader = check_def(def_file)
+  except (RuntimeError, ValueError) as exc:
+   print("elements: error: %s: %s" % (def_file, exc), file=sys.stderr)
+   failed += 1
+   continue
+  except OSError as exc:
+   print("elements: error: could not read `%s`: %s" % (def_file, exc.strerror),
+         file=sys.stderr)
+   failed += 1
+   continue
+  if options.emit_loader:
+   if output == "-":
+    sys.stdout.buffer.write(loader)
+    sys.stdout.buffer.flush()
+   else:
+    with open(output, "wb") as f:
+     f.write(loader)
+ 
+ if len(loaders) > 1:
+  print("%d ok, %d failed" % (len(loaders) - failed, failed), file=sys.stderr)
+ 
+ return 1 if failed else 0
+
+
+def build_def(def_file: str, output: str,  #{{{1
+              cache: Optional["BuildCache"] = None, prefix: str = "",
+              force: bool = False, profile: Optional["BuildProfile"] = None) -> bool:
+ if profile:
+  profile.info["def"] = def_file
+  profile.info["output"] = output
+  profile.info["version"] = __version__
+ 
+ if is_binary_file(def_file):
+  raise ElementError("`%s` is not a definition file" % def_file)
+ 
+ if os.path.exists(output) and not is_binary_file(output):
+  raise ElementError("`%s` exists but is a text file" % output)
+ 
+ with open(def_file, "rb") as def_:
+  el = Element(def_.read())
+ 
+ return el.build(output, os.path.dirname(def_file) or ".",
+                 print_status=True, from_filename=def_file, cache=cache, prefix=prefix,
+                 force=force, profile=profile)
+
+
+def check_def(def_file: str) -> bytes:  #{{{1
+ # returns the loader script for `def_file`, or raises an ElementError
+ if is_binary_file(def_file):
+  raise ElementError("`%s` is not a definition file" % def_file)
+ 
+ with open(def_file, "rb") as def_:
+  el = Element(def_.read())
+ 
+ return el.check()
+
+
+def reserve_stdout() -> TextIO:  #{{{1
+ # Points stdout, including that of the commands we run, to stderr, and
+ # returns a file for the original stdout, so that a --profile report
+ # written there is not mixed with anything else.
+ sys.stdout.flush()
+ result = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+ os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+ return result
+
+
+def write_profile(filename: str, report: Any, stdout: Optional[TextIO] = None) -> None:  #{{{1
+ # writes a --profile report as JSON to `filename`, or `stdout` (default:
+ # sys.stdout) if it is `-`
+ data = json.dumps(report, indent=1) + "\n"
+ if filename == "-":
+  stdout = stdout or sys.stdout
+  stdout.write(data)
+  stdout.flush()
+ else:
+  with open(filename, "w") as f:
+   f.write(data)
+
+
+def find_defs(paths: List[str]) -> List[str]:  #{{{1
+ # the given def files, with directories replaced by the *.def files in them
+ result: List[str] = []
+ for path in paths:
+  if os.path.isdir(path):
+   def_files = sorted(glob.glob(os.path.join(glob.escape(path), "**", "*.def"), recursive=True))
+   if not def_files:
+    raise ElementError("`%s` does not contain any definition files" % path)
+   result += def_files
+  else:
+   result += [path]
+ return result
+
+
+def batch_outputs(paths: List[str], output_dir: str,  #{{{1
+                  suffix: str = "") -> Dict[str, str]:
+ # maps output filenames in `output_dir` to def files (see `find_defs()`)
+ result: Dict[str, str] = OrderedDict()
+ for def_file in find_defs(paths):
+  output = os.path.join(output_dir, batch_output_name(def_file) + suffix)
+  if output in result:
+   raise ElementError("`%s` and `%s` would both be built as `%s`"
+                      % (result[output], def_file, output))
+  result[output] = def_file
+ return result
+
+
+def batch_output_name(def_file: str) -> str:  #{{{1
+ # `foo.def` -> `foo`, and `foo/element.def` -> `foo`
+ name = os.path.splitext(os.path.basename(def_file))[0]
+ if name == "element":
+  name = os.path.basename(os.path.dirname(os.path.abspath(def_file))) or name
+ return name
+
+
 def _parse_args(argv):  #{{{1
  prog = os.path.basename(argv[0])
  prog = prog if prog != "__main__.py" else "elements"
@@ -78,11 +295,40 @@ def _parse_args(argv):  #{{{1
                 help=argparse.SUPPRESS)
  p.add_argument("-V", "--version", action="store_true",
                 help="show version number and exit")
+ p.add_argument("--cache-dir", metavar="DIR", default=None,
+                help="where to cache build artifacts that can be shared between builds"
+                     " (default: $XDG_CACHE_HOME/elements or ~/.cache/elements)")
+ p.add_argument("--no-cache", action="store_true",
+                help="do not use or update the build cache")
+ p.add_argument("-f", "--force", action="store_true",
+                help="build even if the output is up to date, and rebuild the cached"
+                     " root filesystem instead of using it")
+ p.add_argument("--profile", metavar="FILE", default=None,
+                help="write a JSON report of each build stage's wall time, CPU time,"
+                     " and child process resource usage, and of the build's"
+                     " temporary and output sizes, to FILE (- for stdout)")
+ p.add_argument("-O", "--output-dir", metavar="DIR", default=None,
+                help="build every given definition file (or every *.def file in each"
+                     " given directory) into DIR, instead of taking an output_file;"
+                     " outputs are named after the definition file, or after its"
+                     " directory for element.def files")
+ p.add_argument("--check", action="store_true",
+                help="only check that every given definition file (or every *.def"
+                     " file in each given directory) is valid, without building;"
+                     " does not need root")
+ p.add_argument("--emit-loader", action="store_true",
+                help="like --check, but also write each definition file's generated"
+                     " loader script to stdout, or into --output-dir as NAME.sh")
+ p.add_argument("-j", "--jobs", metavar="N", type=int, default=1,
+                help="with --output-dir, the number of definition files to build"
+                     " at the same time (default: 1)")
  p.add_argument("def_", metavar="def_file", default=None, nargs="?",
                 help="the Singularity definition file with Elements extensions"
                      " from which to build")
  p.add_argument("output", metavar="output_file", default=None, nargs="?",
                 help="the output filename")
+ p.add_argument("_more_defs", metavar="def_file", nargs="*",
+                help=argparse.SUPPRESS)
  
  required = {
   "def_": "def_file",
@@ -102,6 +348,14 @@ def _parse_args(argv):  #{{{1
  
  try:
   options = p.parse_args(argv[1:])
+  if options.output_dir or options.check or options.emit_loader:
+   required = {"def_": "def_file"}
+   options.defs = [options.def_] + ([options.output] if options.output else [])
+   options.defs += options._more_defs
+   if options.jobs < 1:
+    p.error("argument -j/--jobs: must be at least 1")
+  elif options._more_defs:
+   p.error("unrecognized arguments: %s" % " ".join(options._more_defs))
   if not options.version and not options._hep_easter_egg:
    missing = [required[k] for k in required if getattr(options, k, None) is None]
    verb = " is" if len(missing) == 1 else "s are"
@@ -124,8 +378,14 @@ def _parse_args(argv):  #{{{1
 
 class Element:  #{{{1
  def_: bytes
+ _rootfs_def: bytes = b""
+ _build_id: str = ""  # unique to each build of an AppImage
+ _profile: Optional["BuildProfile"] = None
  _def_is_docker: bool = False
  _def_docker_ref: str = ""
+ _def_docker_digest: str = ""
+ _def_local_image: str = ""
+ _def_local_image_digest: str = ""
  
  args: List["Arg"]
  binds: List["Bind"]
@@ -135,16 +395,51 @@ class Element:  #{{{1
  
  CONFIG_DEFAULTS = {
   "args": "",
+  "async-cleanup": False,
   "bind": "",
+  "config-backend": "container",
+  "config-cache-size": 0,
   "env": "",
   "name": "elements",
+  "pool-size": 0,
   "ps1-color": 27,
   "resolv": True,
   "root-copyup": False,
+  "root-copyup-mode": "copy",
+  "squashfs-block-size": "",
+  "squashfs-comp": "",
+  "squashfs-level": "",
+  "squashfs-sort": False,
+  "squashfs-sort-list": "",
   "terminal": True,
   "_do_output": False
  }
  
+ CONFIG_CHOICES = {
+  "config-backend": ("container", "direct"),
+  "root-copyup-mode": ("copy", "overlay"),
+  "squashfs-comp": ("gzip", "xz", "zstd", "lz4"),
+ }
+ 
+ # (min, max) for squashfs-level by compressor
+ SQUASHFS_LEVELS = {
+  "gzip": (1, 9),
+  "zstd": (1, 22),
+ }
+ 
+ # AppDir paths that are read when an element starts, in the order they are
+ # placed at the start of the squashfs image with squashfs-sort
+ SQUASHFS_SORT = [
+  "AppRun",
+  "elements-loader.sh",
+  "elements-config.json",
+  "elements-bootstrap.json",
+  "bootstrap",
+  "rootfs/.elements-entry",
+  "rootfs/.singularity.d",
+  "rootfs/exec",
+ ]
+ 
  SPECIAL_ENV = [
   # here, a leading ^ means before user variables and a leading $ means after
   
@@ -177,68 +472,108 @@ class Element:  #{{{1
     self.config[key] = str(default)
  
  def build(self, to_filename: str, context_dir: str,  #{{{2
-           print_status: bool = False, from_filename: str = "") -> None:
+           print_status: bool = False, from_filename: str = "",
+           cache: Optional["BuildCache"] = None, prefix: str = "",
+           force: bool = False, profile: Optional["BuildProfile"] = None) -> bool:
+  # `prefix` goes at the start of every line of output, e.g. to tell
+  # builds apart when several are running at once.  Returns False without
+  # building anything if `to_filename` is up to date, unless `force` is set.
+  # Stage timings and resource usage are recorded in `profile` if given.
+  self._profile = profile
   def _chmod_x(path):
    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
   
   def _status(msg: str = "", color: int = 7, intensity: int = 1):
    if print_status:
-    print("\033[0;%d;3%dm%s\033[0m" % (intensity, color, msg), file=sys.stderr)
+    with OUTPUT_LOCK:
+     print("%s\033[0;%d;3%dm%s\033[0m" % (prefix, intensity, color, msg), file=sys.stderr)
   
   _status("Elements v%s" % __version__)
   _status()
   
   with tempfile.TemporaryDirectory(prefix=".elements-build.") as tmp:
    parsed_def = self._parse(tmpdir=tmp)
+   appimagetool_args = self._appimagetool_args()
    
-   # build bootstrap fs archive  #{{{3
-   _status("Building bootstrap filesystem...")
-   with tempfile.TemporaryDirectory(prefix="bootstrap.", dir=tmp) as bootstrap_dir:
-    bootstrap_def = os.path.join(bootstrap_dir, "bootstrap.def")
-    with open(bootstrap_def, "wb") as f:
-     f.write(BOOTSTRAP_DEF)
-    
-    bootstrap_root = os.path.join(bootstrap_dir, "rootfs")
-    self._run(["singularity", "build", "--sandbox", bootstrap_root, bootstrap_def],cwd=tmp)
-    
-    bootstrap_tar = os.path.join(tmp, "bootstrap.tar")
-    with tarfile.open(bootstrap_tar, "w") as tar:
-     tar.add(bootstrap_dir, arcname=".", recursive=True)
-   _status("")
+   # skip if up to date  #{{{3
+   files_hash = self._hash_files(context_dir)
+   manifest_filename = to_filename + MANIFEST_SUFFIX
+   manifest = self._manifest(files_hash, context_dir, prefix)
+   if not force and os.path.exists(to_filename):
+    try:
+     with open(manifest_filename, "rb") as old_manifest:
+      up_to_date = json.load(old_manifest) == manifest
+    except (OSError, ValueError):
+     up_to_date = False
+    if up_to_date:
+     _status("`%s` is up to date." % to_filename)
+     if profile:
+      profile.info["built"] = False
+     return False
    
-   # skopeo copy status message  #{{{3
-   if self._def_is_docker:
-    _status("Downloading Docker image %s..." % self._def_docker_ref)
+   # the old output no longer matches its manifest once we start replacing it
+   if os.path.lexists(manifest_filename):
+    os.unlink(manifest_filename)
    
-   # skopeo copy -- needed to force correct architecture variant for armv7l  #{{{3
-   if self._def_is_docker:
-    skopeo_args = ["skopeo"]
-    if os.uname().machine == "armv7l":
-     skopeo_args += ["--override-variant", "v7"]
-    ref = self._def_docker_ref
-    oci_dir = os.path.join(tmp, "docker-oci")
-    self._run(skopeo_args + ["copy", f"docker://{ref}", f"containers-storage:{ref}"])
-    self._run(skopeo_args + ["copy", f"containers-storage:{ref}", f"oci:{oci_dir}"])
-    _status()
+   # bootstrap fs and rootfs  #{{{3
+   # These do not depend on each other, so they are built at the same time,
+   # with each one's command output prefixed by its name.
+   def _bootstrap_stage() -> None:
+    stage_prefix = prefix + "[bootstrap] "
+    if cache:
+     bootstrap_key = BuildCache.key(os.uname().machine.encode("utf-8"), BOOTSTRAP_DEF)
+     with cache.get("bootstrap", bootstrap_key, "bootstrap.tar",
+                    lambda path: self._build_bootstrap(path, tmp, _status,
+                                                       stage_prefix)) as (bootstrap_tar, cached):
+      if cached:
+       _status("Using cached bootstrap filesystem...")
+      _extract_bootstrap(bootstrap_tar)
+    else:
+     bootstrap_tar = os.path.join(tmp, "bootstrap.tar")
+     self._build_bootstrap(bootstrap_tar, tmp, _status, stage_prefix)
+     _extract_bootstrap(bootstrap_tar)
+     os.unlink(bootstrap_tar)
+   
+   def _extract_bootstrap(bootstrap_tar: str) -> None:
+    # shipped unpacked so that the loader can use it in place
+    with self._stage("bootstrap-tar"):
+     extract_tar(bootstrap_tar, os.path.join(tmp, "bootstrap"))
    
-   # rootfs status message  #{{{3
-   _status("Building root filesystem%s..."
-           % (" from `%s`" % from_filename if from_filename else ""))
+   def _rootfs_stage() -> None:
+    stage_prefix = prefix + "[rootfs] "
+    if cache:
+     # only the parts of the def that affect the rootfs are part of the key,
+     # so changing `#Elements.*` config keys does not cause a rebuild; the
+     # base image's digest (from the manifest) is too, so that a cached
+     # rootfs is not used once the image's tag points to a new one, and
+     # likewise for a local base image's contents; with `force`, the cached
+     # rootfs is rebuilt instead of used
+     rootfs_key = BuildCache.key(os.uname().machine.encode("utf-8"), self._rootfs_def,
+                                 files_hash, self._def_docker_digest.encode("utf-8"),
+                                 self._def_local_image_digest.encode("utf-8"))
+     with cache.get("rootfs", rootfs_key, "rootfs",
+                    lambda path: self._build_rootfs(path, element_def, tmp,
+                                                    context_dir, from_filename,
+                                                    _status, cache, stage_prefix),
+                    refresh=force) as (cached_root, cached):
+      if cached:
+       _status("Using cached root filesystem%s..."
+               % (" for `%s`" % from_filename if from_filename else ""))
+      with self._stage("rootfs-copy"):
+       self._run(["cp", "-a", cached_root, element_root], prefix=stage_prefix)
+    else:
+     self._build_rootfs(element_root, element_def, tmp, context_dir, from_filename,
+                        _status, cache, stage_prefix)
    
-   # build rootfs  #{{{3
    element_def = os.path.join(tmp, "element.def")
    with open(element_def, "wb") as f:
     f.write(parsed_def)
    
    element_root = os.path.join(tmp, "rootfs")
-   self._run(["singularity", "build", "--sandbox", element_root, element_def],
-             cwd=context_dir)
-   
-   if self._def_is_docker:
-    # tempfile.TemporaryDirectory._rmtree has better error handling
-    with tempfile.TemporaryDirectory(prefix="cleanup.", dir=tmp) as cleanup_dir:
-     print(cleanup_dir)
-     os.rename(oci_dir, os.path.join(cleanup_dir, "docker-oci"))
+   with ThreadPoolExecutor(max_workers=2) as executor:
+    stages = [executor.submit(_bootstrap_stage), executor.submit(_rootfs_stage)]
+   for stage in stages:
+    stage.result()
    
    entry = os.path.join(element_root, ".elements-entry")
    with open(entry, "wb") as f:
@@ -293,10 +628,21 @@ class Element:  #{{{1
    diricon = os.path.join(tmp, ".DirIcon")
    os.symlink(os.path.basename(icon), diricon)
    
-   # compile loader and AppRun  #{{{3
-   loader = os.path.join(tmp, "elements-loader.sh")
-   with open(loader, "wb") as f:
-    f.write(self._compile_loader())
+   # compile loader, runc configs, and AppRun  #{{{3
+   self._build_id = os.urandom(8).hex()
+   
+   with self._stage("compile"):
+    loader = os.path.join(tmp, "elements-loader.sh")
+    with open(loader, "wb") as f:
+     f.write(self._compile_loader())
+    
+    config = os.path.join(tmp, "elements-config.json")
+    with open(config, "wb") as f:
+     f.write(self._compile_config())
+    
+    bootstrap_config = os.path.join(tmp, "elements-bootstrap.json")
+    with open(bootstrap_config, "wb") as f:
+     f.write(self._compile_bootstrap_config())
   
    apprun = os.path.join(tmp, "AppRun")
    with open(apprun, "wb") as f:
@@ -335,16 +681,42 @@ class Element:  #{{{1
    if arch:
     appimagetool_env["ARCH"] = arch
    
-   self._run(["appimagetool", "--no-appstream", tmp, to_filename], env=appimagetool_env)
+   with tempfile.NamedTemporaryFile(prefix=".elements-sort.") as sort_file:
+    if self.config["squashfs-sort"] or self.config["squashfs-sort-list"]:
+     sort_file.write(self._squashfs_sort(tmp, context_dir))
+     sort_file.flush()
+     appimagetool_args += ["--mksquashfs-opt", "-sort", "--mksquashfs-opt", sort_file.name]
+    
+    with self._stage("appimage"):
+     self._run(["appimagetool", "--no-appstream"] + appimagetool_args + [tmp, to_filename],
+               env=appimagetool_env, prefix=prefix)
    _chmod_x(to_filename)
    
+   if profile:
+    profile.info["built"] = True
+    profile.info["tmp_bytes"] = tree_size(tmp)
+    profile.info["image_bytes"] = os.path.getsize(to_filename)
+   
+   with open(manifest_filename, "wb") as f:
+    f.write(json.dumps(manifest, indent=1).encode("utf-8") + b"\n")
+   
    # finished status message  #{{{3
    _status()
    _status("Built `%s`%s."
            % (to_filename, 
               " from `%s`" % from_filename if from_filename else ""))
+  
+  return True
  
- def _run(self, cmd: List[str], *args, **kwargs):  #{{{2
+ def _stage(self, name: str) -> ContextManager:  #{{{2
+  # profiles the enclosed code as stage `name` if profiling
+  if self._profile:
+   return self._profile.stage(name)
+  return contextlib.nullcontext()
+ 
+ def _run(self, cmd: List[str], *args, prefix: str = "", **kwargs):  #{{{2
+  # With a `prefix`, the command's output is printed to stderr a line at a
+  # time with that prefix, unless its output is redirected.
   name_any = cmd[0]
   if isinstance(name_any, bytes):
    name = name_any.decode(sys.getfilesystemencoding())
@@ -356,10 +728,19 @@ class Element:  #{{{1
    check = False
   kwargs["check"] = False
   
-  print("+", " ".join(shlex.quote(arg) for arg in cmd), file=sys.stderr)
+  with OUTPUT_LOCK:
+   print(prefix + "+", " ".join(shlex.quote(arg) for arg in cmd), file=sys.stderr)
   
+  rusage = None
   try:
-   r = subprocess.run(cmd, *args, **kwargs)
+   if args:
+    r = subprocess.run(cmd, *args, **kwargs)
+   elif prefix and not {"stdout", "stderr", "capture_output"} & set(kwargs):
+    del kwargs["check"]
+    r, rusage = run_prefixed(prefix, cmd, **kwargs)
+   else:
+    del kwargs["check"]
+    r, rusage = run_rusage(cmd, **kwargs)
   except FileNotFoundError as exc:
    exc_name_any = exc.filename
    if isinstance(exc_name_any, bytes):
@@ -371,11 +752,205 @@ class Element:  #{{{1
     raise ElementError("%s is not installed on the PATH" % name)
    else:
     raise
+  
+  if self._profile and rusage:
+   self._profile.add_rusage(rusage)
+  
   if check and r.returncode:
    raise ElementError("%s failed with exit code %d" % (name, r.returncode))
   
   return r
+ 
+ def _build_bootstrap(self, to_filename: str, tmpdir: str,  #{{{2
+                      status: Callable[[str], None], prefix: str = "") -> None:
+  status("Building bootstrap filesystem...")
+  with tempfile.TemporaryDirectory(prefix="bootstrap.", dir=tmpdir) as bootstrap_dir:
+   bootstrap_def = os.path.join(bootstrap_dir, "bootstrap.def")
+   with open(bootstrap_def, "wb") as f:
+    f.write(BOOTSTRAP_DEF)
+   
+   bootstrap_root = os.path.join(bootstrap_dir, "rootfs")
+   with self._stage("bootstrap-build"):
+    self._run(["singularity", "build", "--sandbox", bootstrap_root, bootstrap_def],
+              cwd=tmpdir, prefix=prefix)
+   
+   with self._stage("bootstrap-tar"), tarfile.open(to_filename, "w") as tar:
+    tar.add(bootstrap_dir, arcname=".", recursive=True)
+ 
+ def _build_rootfs(self, to_dirname: str, element_def: str, tmpdir: str,  #{{{2
+                   context_dir: str, from_filename: str,
+                   status: Callable[[str], None],
+                   cache: Optional["BuildCache"] = None, prefix: str = "") -> None:
+  # skopeo copy status message  #{{{3
+  if self._def_is_docker:
+   status("Downloading Docker image %s..." % self._def_docker_ref)
+  
+  # skopeo copy  #{{{3
+  if self._def_is_docker:
+   oci_dir = os.path.join(tmpdir, "docker-oci")
+   with self._stage("fetch"):
+    self._fetch_docker_image(oci_dir, cache, prefix)
+  
+  # rootfs status message  #{{{3
+  status("Building root filesystem%s..."
+         % (" from `%s`" % from_filename if from_filename else ""))
+  
+  # build rootfs  #{{{3
+  with self._stage("rootfs-build"):
+   self._run(["singularity", "build", "--sandbox", to_dirname, element_def],
+             cwd=context_dir, prefix=prefix)
+  
+  if self._def_is_docker:
+   # tempfile.TemporaryDirectory._rmtree has better error handling
+   with tempfile.TemporaryDirectory(prefix="cleanup.", dir=tmpdir) as cleanup_dir:
+    print(cleanup_dir)
+    os.rename(oci_dir, os.path.join(cleanup_dir, "docker-oci"))
+ 
+ def _appimagetool_args(self) -> List[str]:  #{{{2
+  # squashfs options, other than squashfs-sort since that needs the AppDir
+  result: List[str] = []
+  comp = str(self.config["squashfs-comp"])
+  if comp:
+   result += ["--comp", comp]
+  
+  level = str(self.config["squashfs-level"])
+  if level:
+   if comp not in self.SQUASHFS_LEVELS:
+    raise ElementError("squashfs-level needs squashfs-comp to be one of %s"
+                       % ", ".join(self.SQUASHFS_LEVELS))
+   min_level, max_level = self.SQUASHFS_LEVELS[comp]
+   if not re.search(r"^[0-9]+$", level) or not min_level <= int(level) <= max_level:
+    raise ElementError("squashfs-level must be an integer from %d to %d for %s"
+                       % (min_level, max_level, comp))
+   result += ["--mksquashfs-opt", "-Xcompression-level", "--mksquashfs-opt", level]
+  
+  block_size = str(self.config["squashfs-block-size"])
+  if block_size:
+   if not re.search(r"^[0-9]+[KkMm]?$", block_size):
+    raise ElementError("squashfs-block-size must be a number of bytes,"
+                       " optionally followed by K or M")
+   result += ["--mksquashfs-opt", "-b", "--mksquashfs-opt", block_size]
+  
+  return result
+ 
+ def _squashfs_sort(self, appdir: str, context_dir: str) -> bytes:  #{{{2
+  # an mksquashfs sort file with the paths from squashfs-sort-list and then
+  # SQUASHFS_SORT first, in order (files in a directory get the directory's
+  # priority)
+  paths = self._squashfs_sort_list(context_dir) + self.SQUASHFS_SORT
+  
+  result = b""
+  priority = 32767
+  seen = set()
+  for path in paths:
+   if path in seen or path.startswith("/") or ".." in path.split("/") or \
+      re.search(r"\s", path):
+    continue
+   seen.add(path)
+   path = os.path.join(os.path.abspath(appdir), path)
+   if os.path.lexists(path):
+    result += b"%s %d\n" % (path.encode("utf-8"), priority)
+    priority = max(priority - 1, 1)
+  return result
+ 
+ def _squashfs_sort_list(self, context_dir: str) -> List[str]:  #{{{2
+  # the AppDir paths in squashfs-sort-list, as recorded by AppRun with
+  # __ELEMENTS_ACCESS_LOG
+  filename = str(self.config["squashfs-sort-list"])
+  if not filename:
+   return []
+  try:
+   with open(os.path.join(context_dir, filename), "r") as f:
+    return [line.rstrip("\n") for line in f if line.strip()]
+  except OSError as exc:
+   raise ElementError("could not read squashfs-sort-list `%s`: %s"
+                      % (filename, exc.strerror))
+ 
+ def _manifest(self, files_hash: bytes, context_dir: str,  #{{{2
+               prefix: str = "") -> Dict[str, Optional[str]]:
+  # Everything that the output depends on, for deciding whether it needs
+  # to be rebuilt.  Local base images are identified by their contents;
+  # other non-Docker base images are not checked for updates.
+  base = None
+  if self._def_is_docker:
+   with self._stage("fetch"):
+    r = self._run(self._skopeo_args() + ["inspect", "--format", "{{.Digest}}",
+                                         f"docker://{self._def_docker_ref}"],
+                  stdout=subprocess.PIPE, prefix=prefix)
+   base = r.stdout.decode("utf-8").strip()
+   self._def_docker_digest = base
+  elif self._def_local_image:
+   # relative to the context directory, like Singularity resolves it
+   h = hashlib.sha256()
+   hash_path(os.path.join(context_dir, self._def_local_image), h)
+   base = "sha256:" + h.hexdigest()
+   self._def_local_image_digest = base
+  
+  sort_list = None
+  if self.config["squashfs-sort-list"]:
+   sort_list = hashlib.sha256("\n".join(self._squashfs_sort_list(context_dir))
+                              .encode("utf-8")).hexdigest()
+  
+  return OrderedDict([
+   ("version", __version__),
+   ("def", hashlib.sha256(self.def_).hexdigest()),
+   ("files", files_hash.hex()),
+   ("base", base),
+   ("sort-list", sort_list),
+  ])
+ 
+ def _skopeo_args(self) -> List[str]:  #{{{2
+  result = ["skopeo"]
+  if os.uname().machine == "armv7l":
+   # needed to force correct architecture variant for armv7l
+   result += ["--override-variant", "v7"]
+  return result
+ 
+ def _fetch_docker_image(self, oci_dir: str,  #{{{2
+                         cache: Optional["BuildCache"] = None, prefix: str = "") -> None:
+  # Copies the def's Docker image straight to an OCI layout at `oci_dir`.
+  # With a cache, the image is copied into a layout in the cache instead,
+  # where skopeo reuses layers that are already there by digest, and
+  # `oci_dir` only gets this image's index and symlinks to the cached blobs.
+  skopeo_args = self._skopeo_args()
+  ref = self._def_docker_ref
+  tag = oci_tag(ref)
+  if self._def_docker_digest:
+   # the digest in the manifest, in case the tag has moved since then
+   ref = docker_ref_at(ref, self._def_docker_digest)
+  
+  if not cache:
+   self._run(skopeo_args + ["copy", f"docker://{ref}", f"oci:{oci_dir}:{tag}"], prefix=prefix)
+   return
+  
+  with cache.lock("oci") as store:
+   self._run(skopeo_args + ["copy", f"docker://{ref}", f"oci:{store}:{tag}"], prefix=prefix)
+   
+   with open(os.path.join(store, "index.json"), "rb") as f:
+    index = json.load(f)
+   index["manifests"] = [
+    i for i in index.get("manifests", [])
+    if i.get("annotations", {}).get("org.opencontainers.image.ref.name") == tag
+   ]
+   
+   blobs = os.path.join(oci_dir, "blobs", "sha256")
+   os.makedirs(blobs)
+   shutil.copy(os.path.join(store, "oci-layout"), oci_dir)
+   with open(os.path.join(oci_dir, "index.json"), "w") as f:
+    json.dump(index, f)
    
+   store_blobs = os.path.abspath(os.path.join(store, "blobs", "sha256"))
+   for blob in os.listdir(store_blobs):
+    os.symlink(os.path.join(store_blobs, blob), os.path.join(blobs, blob))
+ 
+ def check(self) -> bytes:  #{{{2
+  # Parses and compiles the def without building anything, which raises an
+  # ElementError if it is invalid, and returns the loader script.  The
+  # loader's build ID is left empty.
+  self._parse(tmpdir=tempfile.gettempdir())
+  self._appimagetool_args()
+  return self._compile_loader()
+ 
  def _parse(self, tmpdir: str) -> bytes:  #{{{2
   result = self._parse_def(tmpdir=tmpdir)
   self._parse_args(str(self.config["args"]))
@@ -389,6 +964,7 @@ class Element:  #{{{1
   
   reader = io.BytesIO(self.def_)
   header_io = io.BytesIO(b"")
+  rootfs_header_io = io.BytesIO(b"")  # without Elements config lines
   body_io = io.BytesIO(b"")
   in_header = True
   
@@ -402,6 +978,7 @@ class Element:  #{{{1
    else:
     header_io.write(line_bytes)
    
+   raw_line_bytes = line_bytes
    line_bytes = line_bytes.strip()
    
    if line_bytes.startswith(LINE_MAGIC):
@@ -415,6 +992,9 @@ class Element:  #{{{1
      continuation = line.endswith("\\")
     else:
      continuation = False
+     rootfs_header_io.write(raw_line_bytes)
+   else:
+    rootfs_header_io.write(raw_line_bytes)
    
    if line:
     if continuation:
@@ -423,6 +1003,8 @@ class Element:  #{{{1
      value: Union[str, int, bool]
      
      item = line[LINE_MAGIC_LEN:]
+     if ":" not in item:
+      raise ElementError("config key names must be followed by a colon:", line)
      key, value = [i.rstrip() for i in item.split(":", 1)]
      value = value.lstrip()
      
@@ -434,16 +1016,23 @@ class Element:  #{{{1
      if isinstance(self.config[key], bool):
       value = parse_bool(value, line, "%s has an" % key)
      
-     if isinstance(self.config[key], int):
+     if isinstance(self.config[key], int) or (isinstance(self.CONFIG_DEFAULTS[key], int) and
+                                              not isinstance(self.CONFIG_DEFAULTS[key], bool)):
       try:
        value = int(value)
       except ValueError:
        raise ElementError("%s must be an integer:" % key, line)
      
+     if key in self.CONFIG_CHOICES and value not in self.CONFIG_CHOICES[key]:
+      raise ElementError("%s must be one of %s:"
+                         % (key, ", ".join(self.CONFIG_CHOICES[key])), line)
+     
      self.config[key] = value
      continuation = False
      line = ""
   
+  self._rootfs_def = rootfs_header_io.getvalue() + body_io.getvalue()
+  
   # extract docker reference, replace OCI temporary OCI location,
   # and change bootstrap key accordingly
   header = header_io.getvalue().decode("utf-8")
@@ -455,25 +1044,58 @@ class Element:  #{{{1
     self._def_docker_ref = match.group(1).strip()
     oci_dir = os.path.join(tmpdir, "docker-oci")
     header = re.sub(r"^bootstrap:\s*docker\s*$", "Bootstrap: oci", header, flags=re_flags)
-    header = re.sub(r"^from:.*$", "From: " + oci_dir, header, flags=re_flags)
+    header = re.sub(r"^from:.*$", "From: %s:%s" % (oci_dir, oci_tag(self._def_docker_ref)),
+                    header, flags=re_flags)
+  elif re.search(r"^bootstrap:\s*localimage\s*$", header, flags=re_flags):
+   match = re.search(r"^from:(.*)$", header, flags=re_flags)
+   if match and match.group(1):
+    self._def_local_image = match.group(1).strip()
   
   return header.encode("utf-8") + body_io.getvalue()
  
+ def _files_sources(self) -> List[str]:  #{{{2
+  # source paths (or globs) from the def's `%files` section
+  result: List[str] = []
+  section = ""
+  for line in self._rootfs_def.decode("utf-8").splitlines():
+   words = line.split()
+   if line.startswith("%"):
+    # `%files from <stage>` copies between stages, not from the context
+    section = words[0].lower() if len(words) == 1 else ""
+   elif section == "%files" and words and not words[0].startswith("#"):
+    result += [words[0]]
+  return result
+ 
+ def _hash_files(self, context_dir: str) -> bytes:  #{{{2
+  result = hashlib.sha256()
+  for src in self._files_sources():
+   src = os.path.join(context_dir, src)
+   for path in sorted(glob.glob(src)) or [src]:
+    hash_path(path, result)
+  return result.digest()
+ 
+ def _split(self, key: str, spec: str) -> List[str]:  #{{{2
+  # shlex.split(), but with an ElementError for invalid quoting
+  try:
+   return shlex.split(spec)
+  except ValueError as exc:
+   raise ElementError("%s has invalid quoting (%s):" % (key, str(exc).lower()), spec)
+ 
  def _parse_args(self, spec: str) -> None:  #{{{2
-  args = shlex.split(spec)
+  args = self._split("args", spec)
   for arg in args:
    value = Arg(self, arg)
    self.args += [value]
  
  def _parse_env(self, spec: str) -> None:  #{{{2
-  envs = shlex.split(spec)
+  envs = self._split("env", spec)
   self.env += [Env(self, i[1:]) for i in self.SPECIAL_ENV if i.startswith("^")]
   self.env += [Env(self, i) for i in envs]
   self.env += [Env(self, i[1:]) for i in self.SPECIAL_ENV if i.startswith("$")]
 
 
  def _parse_binds(self, spec: str) -> None:  #{{{2
-  binds = shlex.split(spec)
+  binds = self._split("bind", spec)
   self.binds += [Bind(self, i) for i in binds]
  
  def _compile_loader(self) -> bytes:  #{{{2
@@ -484,17 +1106,103 @@ class Element:  #{{{1
   result = result.replace(b"___config_binds___", self._compile_binds().encode("utf-8"))
   result = result.replace(b"___config_misc___", self._compile_misc().encode("utf-8"))
   
+  truthy = "|".join(['"%s"' % i for i in TRUTHY])
+  falsy = "|".join(['"%s"' % i for i in FALSY])
+  bools = ", ".join(['\\"%s\\"' % i for i in BOOLS])
+  result = result.replace(b"___bool_truthy___", truthy.encode("utf-8"))
+  result = result.replace(b"___bool_falsy___", falsy.encode("utf-8"))
+  result = result.replace(b"___bool_values___", bools.encode("utf-8"))
+  
   return result
  
+ def _compile_config(self) -> bytes:  #{{{2
+  # Everything that is known at build time goes here; the loader only fills
+  # in the user namespace mappings and the per-invocation values.
+  spec = json.loads(RUNC_SPEC)
+  
+  spec["process"]["args"] = ["/.elements-entry"]
+  spec["process"]["terminal"] = bool(self.config["terminal"])
+  spec["process"]["env"] = [i for i in spec["process"]["env"] if not i.startswith("TERM=")]
+  spec["root"]["readonly"] = False
+  
+  spec["mounts"] += [{
+   "destination": "/tmp",
+   "type": "tmpfs",
+   "source": "tmpfs",
+   "options": ["nosuid", "nodev", "size=16384k"]
+  }]
+  
+  if self.config["resolv"]:
+   spec["mounts"] += [{
+    "destination": "/etc/resolv.conf",
+    "type": "bind",
+    "source": "/etc/resolv.conf",
+    "options": ["rbind"]
+   }]
+  
+  if self.config["_do_output"]:
+   spec["mounts"] += [{
+    "destination": "/out",
+    "type": "bind",
+    "source": "@ELEMENTS_OUT@",
+    "options": ["rbind"]
+   }, {
+    "destination": "/tmp/out",
+    "type": "bind",
+    "source": "@ELEMENTS_OUT_TMP@",
+    "options": ["rbind"]
+   }]
+  
+  # paths and the remaining arguments are filled in by the loader
+  spec["hooks"] = {
+   "poststop": [
+    {"path": "elements-output.sh", "args": ["elements-output.sh"]},
+    {"path": "elements-cleanup.sh", "args": ["elements-cleanup.sh"]}
+   ]
+  }
+  if self.config["async-cleanup"]:
+   spec["hooks"]["poststop"][-1]["args"] += ["--async"]
+  
+  return json.dumps(spec, indent=1).encode("utf-8") + b"\n"
+ 
+ def _compile_bootstrap_config(self) -> bytes:  #{{{2
+  # The loader fills in the user namespace mappings and paths with sed(1),
+  # since there is no jq before the bootstrap container is running.  The
+  # rootfs is used read-only from the AppImage, and the bootstrap directory
+  # (with the config to be edited) is mounted on /tmp.
+  spec = json.loads(RUNC_SPEC)
+  
+  spec["process"]["terminal"] = False
+  spec["root"]["path"] = "@ELEMENTS_BOOTSTRAP_ROOTFS@"
+  spec["root"]["readonly"] = True
+  spec["mounts"] += [{
+   "destination": "/tmp",
+   "type": "bind",
+   "source": "@ELEMENTS_BOOTSTRAP_DIR@",
+   "options": ["rbind"]
+  }]
+  spec["linux"]["uidMappings"][0]["hostID"] = "@ELEMENTS_UID@"
+  spec["linux"]["gidMappings"][0]["hostID"] = "@ELEMENTS_GID@"
+  
+  result = json.dumps(spec, indent=1)
+  result = result.replace('"@ELEMENTS_UID@"', "@ELEMENTS_UID@")
+  result = result.replace('"@ELEMENTS_GID@"', "@ELEMENTS_GID@")
+  return result.encode("utf-8") + b"\n"
+ 
  def _compile_misc(self) -> str:   #{{{2
   result = "config_misc() {\n%s\n}"
   blocks: List[str] = []
   
   blocks += [
+   "__CONFIG_BUILD_ID=" + self._build_id,
+   "__CONFIG_CONFIG_BACKEND=" + str(self.config["config-backend"]),
+   "__CONFIG_CONFIG_CACHE_SIZE=%d" % int(self.config["config-cache-size"]),
    "__CONFIG_NAME=" + str(self.config["name"] or self.CONFIG_DEFAULTS["name"]),
+   "__CONFIG_POOL_SIZE=%d" % int(self.config["pool-size"]),
    "__CONFIG_PS1_COLOR=%d" % int(self.config["ps1-color"]),
    "__CONFIG_RESOLV=%d" % int(self.config["resolv"]),
    "__CONFIG_ROOT_COPYUP=%d" % int(self.config["root-copyup"]),
+   "__CONFIG_ROOT_COPYUP_MODE=" + str(self.config["root-copyup-mode"]),
    "__CONFIG_TERMINAL=" + str(self.config["terminal"]).lower(),
    "__CONFIG__DO_OUTPUT=%d" % int(self.config["_do_output"])
   ]
@@ -504,30 +1212,33 @@ class Element:  #{{{1
  
  def _compile_args(self) -> str:   #{{{2
   optstring = ""
+  n_positional = 0
   for arg in self.args:
    if arg.is_flag:
     optstring += arg.sh_var
     if not arg.is_bool:
      optstring += ":"
+   else:
+    n_positional += 1
   
   result = """
 config_args() {
  __config_init_bool_flags
- __parse_args '%s' "$@"
+ __parse_args '%s' %d "$@"
 }
-""".strip() % optstring
-  arg_fns: List[str] = []
-
+""".strip() % (optstring, n_positional)
   init_bool_flags_fn = "__config_init_bool_flags() {\n%s\n}\n\n"
   init_bool_flags_items: List[str] = []
   
+  # one case per argument, keyed by the flag or the positional's index
+  arg_fn = "__config_arg() {\n case \"$1\" in\n%s esac\n}"
+  arg_cases: List[str] = []
+  
   pos_i = 1
   for arg in self.args:
-   type_ = "pos" if arg.is_positional else "flag"
-   fn_arg_name = str(pos_i) if arg.is_positional else arg.sh_var
-   fn_code = "__config_%s_arg_%s() {\n%s\n}"
-   fn_code %= (type_, fn_arg_name, arg.compile().strip("\n"))
-   arg_fns += [fn_code]
+   key = str(pos_i) if arg.is_positional else arg.key
+   lines = [key + ")"] + arg.compile().strip("\n").split("\n") + [";;"]
+   arg_cases += [lines[0]] + [" " + i for i in lines[1:]]
    if arg.is_bool:
     init_bool_flags_items += [" %s=0" % arg.sh_var]
    if arg.is_positional:
@@ -538,49 +1249,185 @@ config_args() {
   
   result += "\n\n"
   result += init_bool_flags_fn % "\n".join(init_bool_flags_items)
-  result += "\n\n".join(arg_fns)
+  result += arg_fn % "".join(["  %s\n" % i for i in arg_cases])
   return result
   
  def _compile_env(self) -> str:   #{{{2
+  # a table of `__env` calls (see loader.tpl.sh)
   result = "config_env() {\n%s\n}"
-  env_fns: Dict[str, str] = OrderedDict()
-  
-  env_i = 1
-  for env in self.env:
-   fn_name = "__config_env_%d" % env_i
-   fn_code = "%s() {\n%s\n}" % (fn_name, env.compile().strip("\n"))
-   env_fns[fn_name] = fn_code
-   env_i += 1
-  
-  if len(env_fns):
-   result %= "\n".join([" " + i for i in env_fns.keys()])
-   for fn in env_fns.values():
-    result += "\n\n" + fn
-  else:
-   result %= " true"
-  
+  rows = [" __trace_as __config_env_%d %s" % (i + 1, env.compile())
+          for i, env in enumerate(self.env)]
+  result %= "\n".join(rows) if len(rows) else " true"
   return result
   
  def _compile_binds(self) -> str:   #{{{2
+  # a table of `__bind` calls (see loader.tpl.sh)
   result = "config_binds() {\n%s\n}"
-  bind_fns: Dict[str, str] = OrderedDict()
-  
-  bind_i = 1
-  for bind in self.binds:
-   fn_name = "__config_bind_%d" % bind_i
-   fn_code = "%s() {\n%s\n}" % (fn_name, bind.compile().strip("\n"))
-   bind_fns[fn_name] = fn_code
-   bind_i += 1
-  
-  if len(bind_fns):
-   result %= "\n".join([" " + i for i in bind_fns.keys()])
-   for fn in bind_fns.values():
-    result += "\n\n" + fn
-  else:
-   result %= " true"
-  
+  rows = [" __trace_as __config_bind_%d %s" % (i + 1, bind.compile())
+          for i, bind in enumerate(self.binds)]
+  result %= "\n".join(rows) if len(rows) else " true"
   return result
   
+class BuildCache:  #{{{1
+ # A content-addressed store for build artifacts that can be shared between
+ # builds.  Entries live in `<path>/<kind>/<key>/<name>` and are never
+ # modified once they exist, but they may be replaced as a whole (with
+ # `refresh`) or evicted when nobody is using them.  Only the `keep` most
+ # recently used entries of each kind are kept.
+ path: str
+ keep: int
+ _created: Set[str]
+ 
+ def __init__(self, path: str, keep: int = 8) -> None:
+  self.path = path
+  self.keep = keep
+  self._created = set()
+ 
+ @staticmethod
+ def default_path() -> str:  #{{{2
+  cache_home = os.environ.get("XDG_CACHE_HOME", "")
+  if not cache_home:
+   cache_home = os.path.join(os.path.expanduser("~"), ".cache")
+  return os.path.join(cache_home, "elements")
+ 
+ @staticmethod
+ def key(*parts: bytes) -> str:  #{{{2
+  result = hashlib.sha256()
+  for part in parts:
+   result.update(hashlib.sha256(part).digest())
+  return result.hexdigest()
+ 
+ @contextlib.contextmanager
+ def get(self, kind: str, key: str, name: str,  #{{{2
+         create: Callable[[str], None], refresh: bool = False) -> Iterator[Tuple[str, bool]]:
+  # Yields the path to the entry and whether it already existed, calling
+  # `create(path)` to make it first if needed (or to replace it if `refresh`
+  # is set and this BuildCache has not made it already, so that batch builds
+  # share it).  Concurrent builds wait for each other instead of creating
+  # the same entry twice, and the entry stays in place until the `with`
+  # block ends.
+  result = os.path.join(self.path, kind, key, name)
+  
+  with self._flock(os.path.join(kind, key), fcntl.LOCK_EX) as (path, lock):
+   cached = os.path.exists(result) and (not refresh or result in self._created)
+   if cached:
+    # for eviction
+    os.utime(path)
+   else:
+    self._create(result, create)
+    self._created.add(result)
+   
+   # let other builds use it at the same time
+   fcntl.flock(lock, fcntl.LOCK_SH)
+   self._evict(kind)
+   yield result, cached
+ 
+ @contextlib.contextmanager
+ def lock(self, name: str) -> Iterator[str]:  #{{{2
+  # Holds an exclusive lock on the directory `<path>/<name>`, which is
+  # created if needed, and yields its path.  This is also meant for parts of
+  # the cache that are updated in place, like the shared OCI layout.
+  with self._flock(name, fcntl.LOCK_EX) as (path, lock):
+   yield path
+ 
+ @contextlib.contextmanager
+ def _flock(self, name: str, operation: int) -> Iterator[Tuple[str, BinaryIO]]:  #{{{2
+  path = os.path.join(self.path, name)
+  os.makedirs(path, mode=0o700, exist_ok=True)
+  with open(os.path.join(path, ".lock"), "wb") as lock:
+   fcntl.flock(lock, operation)
+   yield path, lock
+ 
+ @staticmethod
+ def _create(result: str, create: Callable[[str], None]) -> None:  #{{{2
+  tmp = "%s.tmp.%d" % (result, os.getpid())
+  old = "%s.old.%d" % (result, os.getpid())
+  try:
+   create(tmp)
+   if os.path.lexists(result):
+    os.rename(result, old)
+   os.rename(tmp, result)
+  finally:
+   for i in (tmp, old):
+    remove_path(i)
+ 
+ def _evict(self, kind: str) -> None:  #{{{2
+  # removes all but the `keep` most recently used entries of `kind`,
+  # skipping any that are in use
+  try:
+   keys = [i for i in os.scandir(os.path.join(self.path, kind))
+           if i.is_dir() and set(os.listdir(i.path)) - {".lock"}]
+  except OSError:
+   return
+  keys.sort(key=lambda i: i.stat().st_mtime, reverse=True)
+  
+  for key in keys[self.keep:]:
+   try:
+    with self._flock(os.path.join(kind, key.name), fcntl.LOCK_EX | fcntl.LOCK_NB):
+     # the lock file stays so that builds waiting on it do not end up
+     # holding a lock on a deleted file
+     for i in os.listdir(key.path):
+      if i != ".lock":
+       remove_path(os.path.join(key.path, i))
+   except BlockingIOError:
+    pass
+
+
+class BuildProfile:  #{{{1
+ # Wall time, our own CPU time, and the resource usage of child processes
+ # for each build stage, plus anything else in `info`, for --profile.  The
+ # current stage is tracked per thread, so stages can run in parallel.
+ stages: Dict[str, Dict[str, float]]
+ info: Dict[str, Any]
+ 
+ STAGE_FIELDS = ("wall", "cpu", "commands",
+                 "children_user", "children_system", "children_maxrss_kb")
+ 
+ def __init__(self) -> None:
+  self.stages = OrderedDict()
+  self.info = OrderedDict()
+  self._lock = threading.Lock()
+  self._local = threading.local()
+  self._start = time.monotonic()
+ 
+ @contextlib.contextmanager
+ def stage(self, name: str) -> Iterator[None]:  #{{{2
+  stack = self._local.__dict__.setdefault("stack", [])
+  stack.append(name)
+  wall, cpu = time.monotonic(), time.thread_time()
+  try:
+   yield
+  finally:
+   stack.pop()
+   self._add(name, wall=time.monotonic() - wall, cpu=time.thread_time() - cpu)
+ 
+ def add_rusage(self, rusage: Any) -> None:  #{{{2
+  # adds a child process's resource usage to the current thread's stage
+  stack = self._local.__dict__.get("stack")
+  self._add(stack[-1] if stack else "other", commands=1,
+            children_user=rusage.ru_utime, children_system=rusage.ru_stime,
+            children_maxrss_kb=rusage.ru_maxrss)
+ 
+ def _add(self, name: str, **values: float) -> None:  #{{{2
+  with self._lock:
+   stage = self.stages.setdefault(name, OrderedDict((k, 0.0) for k in self.STAGE_FIELDS))
+   for key, value in values.items():
+    if key == "children_maxrss_kb":
+     stage[key] = max(stage[key], value)
+    else:
+     stage[key] += value
+ 
+ def report(self) -> Dict[str, Any]:  #{{{2
+  result: Dict[str, Any] = OrderedDict(self.info)
+  result["wall"] = round(time.monotonic() - self._start, 3)
+  result["stages"] = OrderedDict(
+   (name, OrderedDict((k, round(v, 3) if k != "commands" and k != "children_maxrss_kb"
+                       else int(v)) for k, v in stage.items()))
+   for name, stage in self.stages.items()
+  )
+  return result
+
+
 class Item:  #{{{1
  el: Element
  spec: str
@@ -628,6 +1475,8 @@ class Arg(Item):  #{{{1
    lhs, rhs = spec.split(">", 1)
   else:
    lhs, rhs = spec, ""
+  if ":" not in lhs:
+   raise ElementError("argument spec must be of the form `name:kind`:", spec)
   self.key, self.kind = lhs.split(":", 1)
   
   if self.key.startswith("-"):
@@ -675,16 +1524,15 @@ class Arg(Item):  #{{{1
     self.el.env += [self.value]
  
  def compile(self) -> str:  #{{{2
-  TPL = r"""
- local __compile_what=%s
- %s=%s
- """
-  
+  # the body of this argument's case in `__config_arg`
   sh_value = "1" if self.is_bool else "$__COMPILE_ARG_VALUE"
-  result = TPL % (self.key, self.sh_var, sh_value)
+  result = "%s=%s" % (self.sh_var, sh_value)
   
-  if self.kind != "env" or not self.is_bool:
-   result += self.value.compile()
+  if self.kind == "bind":
+   result += "\n" + self.value.compile()
+  elif not self.is_bool:
+   # error messages name the argument instead of the variable
+   result += "\n" + self.value.compile() + " " + self.key
   
   return result
 
@@ -727,58 +1575,9 @@ class Env(Item):  #{{{1
                       _from + spec)
  
  def compile(self) -> str:  #{{{2
-  TPL = r"""
-%s local __compile_env_name __compile_env_value
- __compile_env_name=%s
- __compile_env_value=%s
- %s
- eval "$__compile_env_name=\"\$__compile_env_value\""
-%s
-"""
-  
-  if not self._from:
-   compile_what = " local __compile_what=%s\n" % self._esc_var_str(self.name)
-  else:
-   compile_what = ""
-  
-  if self.type_ == "int":
-   typecheck = r"""
- if ! ( (printf '%s' "$__compile_env_value" | tr '\n' ' '; echo) | grep -q '^-\?[0-9]\+$')
- then
-  echo "$ARGV0: error: $__compile_what must be an integer" >&2
-  exit 2
- fi
- """
-  elif self.type_ == "bool":
-   truthy = " || ".join(['[ x"$__compile_env_value" = x"%s" ]' % i for i in TRUTHY])
-   falsy = " || ".join(['[ x"$__compile_env_value" = x"%s" ]' % i for i in FALSY])
-   bools = ", ".join(['"%s"' % i for i in BOOLS])
-   typecheck = r"""
- if %s; then
-  __compile_env_value=1
- elif %s; then
-  __compile_env_value=0
- else
-  echo "$ARGV0: error: $__compile_what has an invalid boolean value (must be one of %s)">&2
-  exit 2
- fi
- """ % (truthy, falsy, bools)
-  else:
-   typecheck = ""
-  
-  value = self.value
-  
-  if self._export:
-   export = """
- _jq --arg item "$__compile_env_name=$__compile_env_value" '.process.env |= . + [$item]'
-""".lstrip("\n")
-  else:
-   export = ""
-  
-  params = [compile_what]
-  params += [self._esc_var_str(i) for i in (self.name, value)]
-  params += [typecheck, export]
-  return TPL % tuple(params)
+  # a row of the loader's env table: `__env NAME TYPE EXPORT VALUE`
+  return "__env %s %s %d %s" % (self.name, self.type_, int(self._export),
+                                self._esc_var_str(self.value) or "''")
 
 
 class Bind(Item):  #{{{1
@@ -820,36 +1619,57 @@ class Bind(Item):  #{{{1
                        _from + spec)
  
  def compile(self) -> str:  #{{{2
-  TPL = r"""
- local __compile_bind_src __compile_bind_dest
- __compile_bind_src=$(abspath %s)
- 
- if ! [ -e "$__compile_bind_src" ]; then
-  echo "$ARGV0: error: \`$__compile_bind_src\`: no such file or directory" >&2
-  exit 1
- elif ! [ -r "$__compile_bind_src" ]; then
-  echo "$ARGV0: error: \`$__compile_bind_src\` is not readable" >&2
-  exit 1
- fi
- 
- _jq --arg src "$__compile_bind_src" --arg dest %s --arg mode %s \
-  '.mounts |= . + [{
-   "destination": $dest,
-   "type": "bind",
-   "source": $src,
-   "options": [
-     "rbind",
-     $mode
-   ]
-  }]'
-"""
-  
+  # a row of the loader's bind table: `__bind SRC DEST MODE`
   mode = "rw"
   for i in self.flags:
    if i in ("rw", "ro"):
     mode = i
   
-  return TPL % tuple([self._esc_var_str(i) for i in (self.src, self.dest, mode)])
+  return "__bind %s %s %s" % tuple([self._esc_var_str(i) or "''"
+                                    for i in (self.src, self.dest, mode)])
+
+
+def extract_tar(path: str, dest: str) -> None:  #{{{1
+ with tarfile.open(path, "r") as tar:
+  if hasattr(tarfile, "fully_trusted_filter"):
+   # rootfs archives have absolute symlinks, which the default filter
+   # rejects as of Python 3.14
+   tar.extractall(dest, filter="fully_trusted")
+  else:
+   tar.extractall(dest)
+
+
+def hash_path(path: str, h: Any) -> None:  #{{{1
+ # adds the names, modes, and contents of `path` and everything under it
+ # to the hash object `h`
+ paths = [path]
+ if os.path.isdir(path) and not os.path.islink(path):
+  for dirpath, dirnames, filenames in os.walk(path):
+   dirnames.sort()
+   paths += [os.path.join(dirpath, i) for i in sorted(dirnames + filenames)]
+ 
+ for i in paths:
+  st = os.lstat(i) if os.path.lexists(i) else None
+  h.update(os.path.relpath(i, path).encode("utf-8", "surrogateescape") + b"\0")
+  if st is None:
+   h.update(b"-\0")
+  elif stat.S_ISLNK(st.st_mode):
+   h.update(b"l%o\0" % st.st_mode + os.readlink(i).encode("utf-8", "surrogateescape"))
+  elif stat.S_ISREG(st.st_mode):
+   h.update(b"f%o\0" % st.st_mode)
+   with open(i, "rb") as f:
+    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+     h.update(chunk)
+  else:
+   h.update(b"d%o\0" % st.st_mode)
+
+
+def remove_path(path: str) -> None:  #{{{1
+ # removes `path`, whether it is a directory or not, if it exists
+ if os.path.isdir(path) and not os.path.islink(path):
+  shutil.rmtree(path)
+ elif os.path.lexists(path):
+  os.unlink(path)
 
 
 def is_binary_file(path: str) -> bool:  #{{{1
@@ -868,6 +1688,66 @@ def is_binary_file(path: str) -> bool:  #{{{1
  return False
 
 
+def oci_tag(ref: str) -> str:  #{{{1
+ # a tag for `ref` that is valid in an OCI layout
+ return re.sub(r"[^a-zA-Z0-9._-]", "_", ref)
+
+
+def docker_ref_at(ref: str, digest: str) -> str:  #{{{1
+ # `ref` with its tag or digest replaced by `digest`
+ name = ref.split("@", 1)[0]
+ if ":" in name.rsplit("/", 1)[-1]:
+  name = name.rsplit(":", 1)[0]
+ return "%s@%s" % (name, digest)
+
+
+def run_prefixed(prefix: str, cmd: List[str],  #{{{1
+                 **kwargs) -> Tuple[subprocess.CompletedProcess, Any]:
+ # Like run_rusage(), but prints the command's stdout and stderr to our
+ # stderr with `prefix` at the start of each line.
+ with subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                       stderr=subprocess.STDOUT, **kwargs) as proc:
+  assert proc.stdout is not None
+  for line in proc.stdout:
+   with OUTPUT_LOCK:
+    sys.stderr.flush()
+    sys.stderr.buffer.write(prefix.encode("utf-8") + line)
+    sys.stderr.buffer.flush()
+  return wait_rusage(proc)
+
+
+def run_rusage(cmd: List[str],  #{{{1
+               **kwargs) -> Tuple[subprocess.CompletedProcess, Optional[Any]]:
+ # Like subprocess.run(), but also returns the command's resource usage
+ # (None if its stderr or input are piped, since only stdout can be read
+ # without subprocess reaping the command itself).
+ if kwargs.get("stderr") == subprocess.PIPE or "capture_output" in kwargs or "input" in kwargs:
+  return subprocess.run(cmd, **kwargs), None
+ 
+ with subprocess.Popen(cmd, **kwargs) as proc:
+  stdout = proc.stdout.read() if proc.stdout else None
+  return wait_rusage(proc, stdout)
+
+
+def tree_size(path: str) -> int:  #{{{1
+ # the total size of the files and symlinks under `path`
+ result = 0
+ for dirpath, dirnames, filenames in os.walk(path):
+  for name in filenames:
+   result += os.lstat(os.path.join(dirpath, name)).st_size
+ return result
+
+
+def wait_rusage(proc: subprocess.Popen,  #{{{1
+                stdout: Optional[bytes] = None) -> Tuple[subprocess.CompletedProcess, Any]:
+ _, status, rusage = os.wait4(proc.pid, 0)
+ if os.WIFSIGNALED(status):
+  proc.returncode = -os.WTERMSIG(status)
+ else:
+  proc.returncode = os.WEXITSTATUS(status)
+ return subprocess.CompletedProcess(proc.args, proc.returncode, stdout), rusage
+
+
 def parse_bool(value: Union[str, int, bool],  #{{{1
                line: Optional[str] = None, msg_prefix: Optional[str] = None) -> bool:
  if isinstance(value, (int, bool)):
@@ -900,10 +1780,86 @@ fi
 
 start() {
  if [ x"$__ELEMENTS_USE_DASH" = x"1" ]; then
-  exec dash "$APPDIR/___loader___" "$@"
+  set -- dash "$APPDIR/___loader___" "$@"
  else
-  exec sh "$APPDIR/___loader___" "$@"
+  set -- sh "$APPDIR/___loader___" "$@"
+ fi
+ 
+ if [ x"$__ELEMENTS_ACCESS_LOG" != x"" ]; then
+  record_access "$@"
+  exit
  fi
+ 
+ exec "$@"
+}
+
+
+# Runs the element under strace and writes the AppDir paths that it opens
+# in the first $__ELEMENTS_ACCESS_LOG_SECONDS seconds (default 10) to
+# $__ELEMENTS_ACCESS_LOG, in the order they were first opened.  Paths
+# opened inside the container are written relative to rootfs.  This list
+# can be given to the builder with the squashfs-sort-list config key.
+#
+# The container's processes are the one that exec()s /.elements-entry and
+# its descendants.  Other paths outside of the AppDir are opened on the
+# host (by the loader, runc, and their libraries), so they are left out.
+record_access() {
+ if ! command -v strace >/dev/null 2>&1; then
+  echo "AppRun: error: strace is needed to record file accesses" >&2
+  exit 127
+ fi
+ 
+ # clone(2) returns PIDs in the container's namespace, which are not the
+ # ones that strace prefixes lines with, unless they are translated
+ pidns=
+ if strace --pidns-translation -o /dev/null true 2>/dev/null; then
+  pidns=--pidns-translation
+ fi
+ 
+ trace=$(mktemp)
+ status=0
+ strace -f -ttt -qq -s 4096 $pidns -o "$trace" \
+  -e trace=open,openat,openat2,execve,execveat,process "$@" || status=$?
+ 
+ awk -v appdir="$APPDIR" -v seconds="${__ELEMENTS_ACCESS_LOG_SECONDS:-10}" '
+  {
+   if (start == "") start = $2
+   if ($2 - start > seconds) exit
+   pid = $1
+   
+   if ($3 ~ /^execve\("\/\.elements-entry"/)
+    container[pid] = 1
+   if ((pid in container) && $0 ~ / = [0-9]+/ &&
+       ($3 ~ /^(clone|clone3|fork|vfork)\(/ || $4 ~ /^(clone|clone3|fork|vfork)$/)) {
+    child = $0
+    if (match(child, /\/\* [0-9]+ in strace.s PID NS \*\//))
+     child = substr(child, RSTART + 3)
+    else
+     child = substr(child, match(child, / = [0-9]+/) + 3)
+    container[child + 0] = 1
+   }
+   
+   if ($3 !~ /^(open|openat|openat2|execve|execveat)\(/ || $0 ~ / = -1 /) next
+   
+   path = substr($0, index($0, "\"") + 1)
+   path = substr(path, 1, index(path, "\"") - 1)
+   if (substr(path, 1, 1) != "/") next
+   if (index(path, appdir "/") == 1)
+    path = substr(path, length(appdir) + 2)
+   else if (pid in container)
+    path = "rootfs" path
+   else
+    next
+   
+   if (!(path in seen)) {
+    seen[path] = 1
+    print path
+   }
+  }
+ ' "$trace" > "$__ELEMENTS_ACCESS_LOG" || status=$?
+ 
+ rm -f "$trace"
+ return $status
 }
 
 
@@ -944,6 +1900,17 @@ From: alpine
 CLEANUP: bytes = br"""
 #!/bin/sh
 
+# With --async, the directories are renamed into a trash directory on the
+# same filesystem and deleted in the background, so that runc (and the
+# element's caller) need not wait for large copyups to be deleted, and so
+# that their names can be reused right away.  `ELEMENT --elements-gc`
+# deletes anything left in the trash.
+async=0
+if [ x"$1" = x"--async" ]; then
+ async=1
+ shift
+fi
+
 if [ x"$1" = x"" ]; then
  echo "$0: error: bundle directory not given" >&2
  exit 2
@@ -953,22 +1920,65 @@ bundle=$1
 shm=$2
 out_tmp=$3
 
-if (! [ -f "$bundle/magic" ]) || [ x"$(cat "$bundle/magic")" != x"Elements" ]; then
+magic=
+read -r magic 2>/dev/null < "$bundle/magic" || true
+if [ x"$magic" != x"Elements" ]; then
  echo "$0: error: bundle is not an Elements bundle" >&2
  exit 2
 fi
 
+# moves $1 into `.@trash` next to it and sets $trashed to its new path, or
+# to $1 if it could not be moved
+trash() {
+ trashed=$1
+ mkdir -m 0700 -p "${1%/*}/.@trash" 2>/dev/null || return 0
+ local dest=
+ dest=$(mktemp -u "${1%/*}/.@trash/${1##*/}.XXXXXX") || return 0
+ if mv "$1" "$dest" 2>/dev/null; then
+  trashed=$dest
+ fi
+}
+
 rm -f "$bundle/appdir"
-rm -rf "$bundle"
+if [ $async -ne 0 ]; then
+ trash "$bundle"
+ bundle=$trashed
+fi
 
 if [ x"$shm" != x"" ] && [ -d "$shm" ]; then
- chmod -R +w "$shm"
- rm -rf "$shm"
+ if [ -d "$shm/upper" ]; then
+  # overlay-mode copyup
+  fusermount3 -u "$shm/copyup" 2>/dev/null || fusermount -u "$shm/copyup" 2>/dev/null || true
+ fi
+ if [ $async -ne 0 ]; then
+  trash "$shm"
+  shm=$trashed
+ fi
+else
+ shm=
+fi
+
+if ! ([ x"$out_tmp" != x"" ] && [ -d "$out_tmp" ]); then
+ out_tmp=
 fi
 
-if [ x"$out_tmp" != x"" ] && [ -d "$out_tmp" ]; then
- chmod -R +w "$out_tmp"
- rm -rf "$out_tmp"
+remove() {
+ rm -rf "$bundle"
+ if [ x"$shm" != x"" ]; then
+  chmod -R +w "$shm"
+  rm -rf "$shm"
+ fi
+ if [ x"$out_tmp" != x"" ]; then
+  chmod -R +w "$out_tmp"
+  rm -rf "$out_tmp"
+ fi
+}
+
+if [ $async -ne 0 ]; then
+ # runc waits for the hook's output to be closed, not just for it to exit
+ remove </dev/null >/dev/null 2>&1 &
+else
+ remove
 fi
 """.lstrip()
 
@@ -1013,14 +2023,33 @@ fi
 
 src="$out_tmp/$src"
 
-entries=$(ls -A -1 "$src" | wc -l)
-if [ x"$entries" = x"0" ]; then
+# a single entry is exported by itself, without the directory around it
+entries=0
+for entry in "$src"/* "$src"/.[!.]* "$src"/..?*; do
+ if [ -e "$entry" ] || [ -L "$entry" ]; then
+  entries=$((entries + 1))
+  last=$entry
+ fi
+done
+if [ $entries -eq 0 ]; then
  exit
-elif [ x"$entries" = x"1" ]; then
- src="$src/$(ls -A -1 "$src" | head -n 1)"
+elif [ $entries -eq 1 ]; then
+ src=$last
 fi
 
-mv "$src" "$dest" || true
+# The temporary directory is made next to the destination, so this is
+# normally just a rename.  If the destination is on another filesystem, the
+# copy shares extents with the source where the filesystem supports reflinks
+# (and cp uses copy_file_range(2) where it can), rather than mv's plain copy.
+case "$dest" in
+ */*) dest_dir=${dest%/*}; dest_dir=${dest_dir:-/};;
+ *) dest_dir=.;;
+esac
+if [ x"$(stat -c %d -- "$out_tmp")" = x"$(stat -c %d -- "$dest_dir")" ]; then
+ mv "$src" "$dest" || true
+elif cp -pPR --reflink=auto "$src" "$dest" 2>/dev/null || cp -pPR "$src" "$dest"; then
+ rm -rf "$src"
+fi
 """.lstrip()
 
 
@@ -1066,6 +2095,150 @@ PS1='$HOSTNAME${HOSTNAME:+:}$ELEMENTS_ID:$(pwd=$(pwd); [ x"$pwd" = x"$HOME" ] &&
 """.lstrip()
 
 
+# RUNC_SPEC  #{{{1
+# the output of `runc spec --rootless`, minus the user namespace mappings'
+# host IDs, which are filled in by the loader
+RUNC_SPEC: bytes = br"""
+{
+ "ociVersion": "1.0.2-dev",
+ "process": {
+  "terminal": true,
+  "user": {
+   "uid": 0,
+   "gid": 0
+  },
+  "args": [
+   "sh"
+  ],
+  "env": [
+   "PATH=/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin",
+   "TERM=xterm"
+  ],
+  "cwd": "/",
+  "capabilities": {
+   "bounding": [
+    "CAP_AUDIT_WRITE",
+    "CAP_KILL",
+    "CAP_NET_BIND_SERVICE"
+   ],
+   "effective": [
+    "CAP_AUDIT_WRITE",
+    "CAP_KILL",
+    "CAP_NET_BIND_SERVICE"
+   ],
+   "inheritable": [
+    "CAP_AUDIT_WRITE",
+    "CAP_KILL",
+    "CAP_NET_BIND_SERVICE"
+   ],
+   "permitted": [
+    "CAP_AUDIT_WRITE",
+    "CAP_KILL",
+    "CAP_NET_BIND_SERVICE"
+   ],
+   "ambient": [
+    "CAP_AUDIT_WRITE",
+    "CAP_KILL",
+    "CAP_NET_BIND_SERVICE"
+   ]
+  },
+  "rlimits": [
+   {
+    "type": "RLIMIT_NOFILE",
+    "hard": 1024,
+    "soft": 1024
+   }
+  ],
+  "noNewPrivileges": true
+ },
+ "root": {
+  "path": "rootfs",
+  "readonly": true
+ },
+ "hostname": "runc",
+ "mounts": [
+  {
+   "destination": "/proc",
+   "type": "proc",
+   "source": "proc"
+  },
+  {
+   "destination": "/dev",
+   "type": "tmpfs",
+   "source": "tmpfs",
+   "options": ["nosuid", "strictatime", "mode=755", "size=65536k"]
+  },
+  {
+   "destination": "/dev/pts",
+   "type": "devpts",
+   "source": "devpts",
+   "options": ["nosuid", "noexec", "newinstance", "ptmxmode=0666", "mode=0620"]
+  },
+  {
+   "destination": "/dev/shm",
+   "type": "tmpfs",
+   "source": "shm",
+   "options": ["nosuid", "noexec", "nodev", "mode=1777", "size=65536k"]
+  },
+  {
+   "destination": "/dev/mqueue",
+   "type": "mqueue",
+   "source": "mqueue",
+   "options": ["nosuid", "noexec", "nodev"]
+  },
+  {
+   "destination": "/sys",
+   "type": "none",
+   "source": "/sys",
+   "options": ["rbind", "nosuid", "noexec", "nodev", "ro"]
+  }
+ ],
+ "linux": {
+  "uidMappings": [
+   {
+    "containerID": 0,
+    "hostID": 0,
+    "size": 1
+   }
+  ],
+  "gidMappings": [
+   {
+    "containerID": 0,
+    "hostID": 0,
+    "size": 1
+   }
+  ],
+  "namespaces": [
+   {"type": "pid"},
+   {"type": "ipc"},
+   {"type": "uts"},
+   {"type": "mount"},
+   {"type": "user"}
+  ],
+  "maskedPaths": [
+   "/proc/acpi",
+   "/proc/asound",
+   "/proc/kcore",
+   "/proc/keys",
+   "/proc/latency_stats",
+   "/proc/timer_list",
+   "/proc/timer_stats",
+   "/proc/sched_debug",
+   "/sys/firmware",
+   "/proc/scsi"
+  ],
+  "readonlyPaths": [
+   "/proc/bus",
+   "/proc/fs",
+   "/proc/irq",
+   "/proc/sys",
+   "/proc/sysrq-trigger"
+  ]
+ }
+}
+""".lstrip()
+
+
 # SH_SCRIPT  #{{{1
 SH_SCRIPT: bytes = br"""
 #!/bin/sh
@@ -11,6 +11,45 @@ ELEMENTS_ID=
 ELEMENTS_INSTANCE=
 ELEMENTS_NAME=
 
+
+# With __ELEMENTS_TRACE set to a filename, `__trace begin|end NAME` appends
+# a JSON line with the system uptime (a monotonic clock read without
+# forking, in hundredths of a second) to that file for each startup phase
+# and each compiled env and bind item.
+__trace() {
+ if [ x"$__ELEMENTS_TRACE" != x"" ]; then
+  local t=null idle=
+  read -r t idle 2>/dev/null < /proc/uptime || true
+  printf '{"t":%s,"pid":%d,"element":"%s","event":"%s","name":"%s"}\n' \
+   "${t:-null}" $$ "$__CONFIG_NAME" "$1" "$2" >> "$__ELEMENTS_TRACE"
+ fi
+}
+
+__trace_call() {
+ __trace begin "$1"
+ "$@"
+ __trace end "$1"
+}
+
+# `__trace_as NAME COMMAND [ARG]...` is like __trace_call, but traces the
+# command as NAME, for the compiled env and bind items
+__trace_as() {
+ local __trace_name="$1"; shift
+ __trace begin "$__trace_name"
+ "$@"
+ __trace end "$__trace_name"
+}
+
+# config_misc is a fill-in with the build's constant config values; it is
+# called before anything else so that the trace has the element's name
+___config_misc___
+
+config_misc
+
+__trace begin loader
+__trace begin script-setup
+
+
 __PWD=$(pwd)
 
 
@@ -30,13 +69,20 @@ if [ x"$ARGV0" = x"" ]; then
  ARGV0=element
 fi
 
+# looked up once; id(1) is the only portable way to get these
+__UID=$(id -u)
+__GID=$(id -g)
 
-STATE_ROOT="/tmp/.elements-ctr-u$(id -u)"
+
+STATE_ROOT="/tmp/.elements-ctr-u$__UID"
 if [ x"$XDG_RUNTIME_DIR" != x"" ] && [ -d "$XDG_RUNTIME_DIR" ]; then
  XDG_STATE_ROOT="$XDG_RUNTIME_DIR/elements"
  if [ -e "$XDG_STATE_ROOT" ]; then
-  if [ -d "$XDG_STATE_ROOT" ] && [ -r "$XDG_STATE_ROOT/.@magic" ] && \
-     [ x"$(cat "$XDG_STATE_ROOT/.@magic" || true)" = x"$ELEMENTS_MAGIC" ]; then
+  __magic=
+  if [ -d "$XDG_STATE_ROOT" ] && [ -r "$XDG_STATE_ROOT/.@magic" ]; then
+   read -r __magic < "$XDG_STATE_ROOT/.@magic" || true
+  fi
+  if [ x"$__magic" = x"$ELEMENTS_MAGIC" ]; then
    STATE_ROOT=$XDG_STATE_ROOT
   fi
  else
@@ -51,7 +97,7 @@ if ! [ -e "$STATE_ROOT/.@magic" ]; then
  chmod 0600 "$STATE_ROOT/.@magic"
 fi
 
-SHM_ROOT="/dev/shm/elements-u$(id -u)"
+SHM_ROOT="/dev/shm/elements-u$__UID"
 
 
 BOOTSTRAP_BUNDLE=
@@ -67,6 +113,7 @@ cleanup() {
   "$APPDIR/elements-cleanup.sh" "$FINAL_BUNDLE" || true
  fi
  if [ x"$SHM_DIR" != x"" ] && [ -d "$SHM_DIR" ]; then
+  unmount_copyup "$SHM_DIR"
   rm -rf "$SHM_DIR" || true
  fi
  if [ x"$OUT_TMP_DIR" != x"" ] && [ -d "$OUT_TMP_DIR" ]; then
@@ -76,63 +123,280 @@ cleanup() {
 
 trap 'cleanup' INT TERM 0
 
+__trace end script-setup
+
 
+# overlay-mode copyups are mounted on `$1/copyup`, with their writable layer
+# in `$1/upper`
+unmount_copyup() {
+ if [ -d "$1/upper" ]; then
+  fusermount3 -u "$1/copyup" 2>/dev/null || fusermount -u "$1/copyup" 2>/dev/null || true
+ fi
+}
+
+
+# sets __RANDOM_12 to 12 random alphanumeric characters
 random_12() {
- printf '%s\n' "$(mktemp -u XXXXXX)$(mktemp -u XXXXXX)"
+ __RANDOM_12=$(mktemp -u XXXXXXXXXXXX)
+}
+
+
+# garbage collection  #{{{2
+
+# `ELEMENT --elements-gc` reclaims what killed containers (or interrupted
+# cleanups) have left behind, for all of this user's elements:  bundles
+# whose loader/runc and container processes are both gone, along with their
+# shm and output temporary directories; bootstrap bundles whose loader is
+# gone; partial pool copies with no refiller, and whole pools with no
+# refiller that are either from an earlier build of this element or owned
+# by an AppImage/AppDir that no longer exists (see `refill_pool`); and
+# trash from async-cleanup.
+# It prints roughly how much space (as counted by du) was freed.
+
+# adds the disk usage of its arguments, in KiB, to $__GC_FREED, and counts
+# them as one item
+gc_measure() {
+ local path= kb=
+ for path; do
+  if [ x"$path" != x"" ] && [ -e "$path" ]; then
+   kb=$(du -sk "$path" 2>/dev/null)
+   kb=${kb%%[!0-9]*}
+   __GC_FREED=$(($__GC_FREED + ${kb:-0}))
+  fi
+ done
+ __GC_ITEMS=$(($__GC_ITEMS + 1))
+}
+
+# succeeds if the PID in file $1 is running
+gc_alive() {
+ local pid=
+ read -r pid 2>/dev/null < "$1" || true
+ [ x"$pid" != x"" ] && kill -0 "$pid" 2>/dev/null
+}
+
+gc() {
+ trap - INT TERM 0
+ set +e
+ 
+ __GC_FREED=0
+ __GC_ITEMS=0
+ 
+ local bundle= id= shm= out_tmp= entry= pool= owner=
+ 
+ for bundle in "$STATE_ROOT"/* "$STATE_ROOT"/.[!.@]*; do
+  if ! [ -f "$bundle/magic" ] || ! [ -f "$bundle/loader-pid" ]; then
+   continue
+  fi
+  if gc_alive "$bundle/loader-pid" || gc_alive "$bundle/pid"; then
+   continue
+  fi
+  id=${bundle##*/}
+  shm=
+  if [ -L "$bundle/shm" ]; then
+   shm=$(readlink "$bundle/shm")
+  fi
+  out_tmp=
+  if [ -L "$bundle/out_tmp" ]; then
+   out_tmp=$(readlink "$bundle/out_tmp")
+  fi
+  runc delete -f "$id" >/dev/null 2>&1
+  if [ -d "$shm/upper" ]; then
+   # don't count the overlay-mode copyup's lower layer
+   gc_measure "$bundle" "$shm/upper" "$shm/work" "$out_tmp"
+  else
+   gc_measure "$bundle" "$shm" "$out_tmp"
+  fi
+  "$APPDIR/elements-cleanup.sh" "$bundle" "$shm" "$out_tmp" >/dev/null 2>&1
+ done
+ 
+ for entry in "$STATE_ROOT"/.@bootstrap.*; do
+  if [ -f "$entry/loader-pid" ] && ! gc_alive "$entry/loader-pid"; then
+   gc_measure "$entry"
+   rm -rf "$entry"
+  fi
+ done
+ 
+ for pool in "$SHM_ROOT"/.@pool.*; do
+  if [ -d "$pool/.lock" ] && gc_alive "$pool/.lock/pid"; then
+   continue
+  fi
+  owner=
+  read -r owner 2>/dev/null < "$pool/owner" || true
+  if [ x"$owner" != x"" ] && [ x"$pool" != x"$SHM_ROOT/.@pool.$__CONFIG_BUILD_ID" ] && \
+     ( [ x"$owner" = x"${APPIMAGE:-$APPDIR}" ] || ! [ -e "$owner" ] ); then
+   # nothing can claim its ready copies any more
+   gc_measure "$pool"
+   chmod -R +w "$pool" 2>/dev/null
+   rm -rf "$pool"
+   continue
+  fi
+  for entry in "$pool"/tmp.* "$pool/.lock"; do
+   if [ -e "$entry" ]; then
+    gc_measure "$entry"
+    chmod -R +w "$entry" 2>/dev/null
+    rm -rf "$entry"
+   fi
+  done
+ done
+ 
+ for entry in "$STATE_ROOT"/.@trash/* "$SHM_ROOT"/.@trash/*; do
+  if [ -e "$entry" ]; then
+   gc_measure "$entry"
+   chmod -R +w "$entry" 2>/dev/null
+   rm -rf "$entry"
+  fi
+ done
+ 
+ echo "elements: freed $(($__GC_FREED * 1024)) bytes from $__GC_ITEMS items"
 }
 
+if [ x"$1" = x"--elements-gc" ]; then
+ gc
+ exit 0
+fi
+
 
 # argument parsing  #{{{2
 
+# Parses the arguments in one pass with getopts(1)'s rules for flags, which
+# may be grouped (e.g. `-vH value` or `-vHvalue`).  Flags and positional
+# arguments can be mixed, and everything after the first `--` is positional.
+# A flag whose value is in the next argument is left pending until the loop
+# gets to that argument, so the arguments never have to be shifted.
 __parse_args() {
- local __compile_optstring="$1"; shift
+ local __compile_optstring="$1" __compile_n_positional="$2"; shift 2
  
- local __positional=1
- local __dash_dash=0
- while [ $# -gt 0 ]; do
-  if [ $__dash_dash -eq 0 ]; then
-   local __dash_dash_pos=-1; local i=1
-   for arg; do
-    if [ x"$arg" = x"--" ]; then
-     __dash_dash_pos=$i
-     break
-    fi
-    i=$(($i + 1))
-   done
-   OPTIND=1
-   while getopts "$__compile_optstring" __compile_opt; do
-    if [ x"$__compile_opt" = x"?" ]; then
+ local __positional=1 __dash_dash=0 __pending= __arg= __opts= __opt= __kind=
+ for __arg; do
+  if [ x"$__pending" != x"" ]; then
+   __COMPILE_ARG_VALUE=$__arg
+   __config_arg "-$__pending"
+   __pending=
+   continue
+  fi
+  
+  case "$__dash_dash$__arg" in
+   0--)
+    __dash_dash=1
+    ;;
+   0-?*)
+    __opts=${__arg#-}
+    while [ x"$__opts" != x"" ]; do
+     __opt=${__opts%"${__opts#?}"}
+     __opts=${__opts#?}
+     case "$__opt" in
+      :) __kind=;;  # would otherwise match the optstring
+      *)
+       case "$__compile_optstring" in
+        *"$__opt:"*) __kind=value;;
+        *"$__opt"*) __kind=bool;;
+        *) __kind=;;
+       esac
+       ;;
+     esac
+     if [ x"$__kind" = x"" ]; then
+      echo "$ARGV0: error: unknown option \`-$__opt\`" >&2
+      exit 2
+     elif [ x"$__kind" = x"bool" ]; then
+      __COMPILE_ARG_VALUE=
+      __config_arg "-$__opt"
+     elif [ x"$__opts" != x"" ]; then
+      __COMPILE_ARG_VALUE=$__opts
+      __opts=
+      __config_arg "-$__opt"
+     else
+      __pending=$__opt
+     fi
+    done
+    ;;
+   *)
+    if [ $__positional -gt $__compile_n_positional ]; then
+     echo "$ARGV0: error: too many arguments (starting with \`$__arg\`)" >&2
      exit 2
     fi
-    __COMPILE_ARG_VALUE=$OPTARG
-    unset OPTARG
-    eval "__config_flag_arg_$__compile_opt"
-    OPTARG=$__COMPILE_ARG_VALUE
-   done
-  fi
-  if [ $__dash_dash -eq 0 ] && [ $OPTIND -eq $(($__dash_dash_pos + 1)) ]; then
-   __dash_dash=1
-   shift $((OPTIND - 1))
-  elif [ $OPTIND -eq 1 ]; then
-   __COMPILE_ARG_VALUE=$1
-   eval "__config_pos_arg_$__positional"
-   shift
-   __positional=$(($__positional + 1))
-  else
-   shift $(($OPTIND - 1))
-  fi
-  unset __COMPILE_ARG_VALUE __COMPILE_OPTIND OPTARG
+    __COMPILE_ARG_VALUE=$__arg
+    __config_arg $__positional
+    __positional=$(($__positional + 1))
+    ;;
+  esac
  done
+ 
+ if [ x"$__pending" != x"" ]; then
+  echo "$ARGV0: error: option \`-$__pending\` requires a value" >&2
+  exit 2
+ fi
+ unset __COMPILE_ARG_VALUE
 }
 
 
-# fill-ins  #{{{2
+# items  #{{{2
 
-# miscellaneous  #{{{3
+# The compiled config is a table of calls to these, one per argument,
+# environment variable, or bind.
 
-___config_misc___
+# `__env NAME TYPE EXPORT VALUE [WHAT]` checks that VALUE is of TYPE (str,
+# int, or bool, which becomes 1 or 0), sets $NAME to it, and, if EXPORT is 1,
+# adds it to the container's environment.  WHAT is what error messages call
+# the item (default: NAME).
+__env() {
+ local __compile_env_name="$1" __compile_env_value="$4" __compile_what="${5:-$1}"
+ case "$2" in
+  int)
+   case "$__compile_env_value" in
+    ''|-|?*-*|*[!0-9-]*)
+     echo "$ARGV0: error: $__compile_what must be an integer" >&2
+     exit 2
+     ;;
+   esac
+   ;;
+  bool)
+   case "$__compile_env_value" in
+    ___bool_truthy___) __compile_env_value=1;;
+    ___bool_falsy___) __compile_env_value=0;;
+    *)
+     echo "$ARGV0: error: $__compile_what has an invalid boolean value (must be one of ___bool_values___)" >&2
+     exit 2
+     ;;
+   esac
+   ;;
+ esac
+ 
+ eval "$__compile_env_name=\"\$__compile_env_value\""
+ if [ $3 -ne 0 ]; then
+  _jq --arg item "$__compile_env_name=$__compile_env_value" '.process.env |= . + [$item]'
+ fi
+}
+
+# `__bind SRC DEST MODE` bind-mounts SRC, which must exist, on DEST in the
+# container, with MODE being ro or rw.
+__bind() {
+ local __compile_bind_src
+ abspath "$1"
+ __compile_bind_src=$__ABSPATH
+ 
+ if ! [ -e "$__compile_bind_src" ]; then
+  echo "$ARGV0: error: \`$__compile_bind_src\`: no such file or directory" >&2
+  exit 1
+ elif ! [ -r "$__compile_bind_src" ]; then
+  echo "$ARGV0: error: \`$__compile_bind_src\` is not readable" >&2
+  exit 1
+ fi
+ 
+ _jq --arg src "$__compile_bind_src" --arg dest "$2" --arg mode "$3" \
+  '.mounts |= . + [{
+   "destination": $dest,
+   "type": "bind",
+   "source": $src,
+   "options": [
+     "rbind",
+     $mode
+   ]
+  }]'
+}
 
 
+# fill-ins  #{{{2
+
 # arguments  #{{{3
 
 ___config_args___
@@ -150,97 +414,390 @@ ___config_binds___
 
 # bundle init  #{{{2
 
+__trace begin bundle-init
+
 BOOTSTRAP_BUNDLE=$(mktemp -d "$STATE_ROOT/.@bootstrap.XXXXXX"); r=$?
 if [ $r -ne 0 ]; then
  echo "elements: error: could not make bootstrap directory (mktemp error $r)" >&2
  exit 127
 fi
 chmod 0700 "$BOOTSTRAP_BUNDLE"
+printf '%s\n' $$ > "$BOOTSTRAP_BUNDLE/loader-pid"  # for --elements-gc
 
-runc spec -b "$BOOTSTRAP_BUNDLE" --rootless
+__trace end bundle-init
 
 
 # prepare bootstrap environment  #{{{2
 
-(cd "$BOOTSTRAP_BUNDLE" && tar -xf "$APPDIR/bootstrap.tar")
-rm -f "$BOOTSTRAP_BUNDLE/bootstrap.def"
-
-# disable terminal and readonly rootfs
-awk '
- BEGIN { terminal = 0; ro = 0 };
- /"terminal":[ \t]*true/ {
-  if (!terminal) {
-   sub(/"terminal":[ \t]*true/, "\"terminal\": false");
-   terminal = 1;
-  }
- };
- /"readonly":[ \t]*true/ {
-  if (!ro) {
-   sub(/"readonly":[ \t]*true/, "\"readonly\": false");
-   ro = 1;
-  }
- };
- { print }
-' "$BOOTSTRAP_BUNDLE/config.json" > "$BOOTSTRAP_BUNDLE/config.tmp"
-mv "$BOOTSTRAP_BUNDLE/config.tmp" "$BOOTSTRAP_BUNDLE/config.json"
+# the bootstrap directory holds the config being edited; with the container
+# config backend, it is also the bundle for the bootstrap container, which
+# runs directly on the read-only bootstrap rootfs in the AppImage, and with
+# the direct config backend, jq is run from that rootfs without a container
+
+# sets __SED_JSON_ESCAPED to $1 escaped for a JSON string in the replacement
+# part of `sed -e 's|...|...|'`; control characters (such as newlines) are
+# escaped as \uXXXX, which needs a subshell, but they are rare in paths
+sed_json_escape() {
+ local s="$1" pre= c=
+ __SED_JSON_ESCAPED=
+ while :; do
+  case "$s" in
+   *[\\\"\|\&[:cntrl:]]*) ;;
+   *) break;;
+  esac
+  pre=${s%%[\\\"\|\&[:cntrl:]]*}
+  s=${s#"$pre"}
+  c=${s%"${s#?}"}
+  s=${s#?}
+  case "$c" in
+   \\) c='\\\\';;
+   \") c='\\"';;
+   [\|\&]) c="\\$c";;
+   *) c=$(printf '\\\\u%04x' "'$c");;
+  esac
+  __SED_JSON_ESCAPED="$__SED_JSON_ESCAPED$pre$c"
+ done
+ __SED_JSON_ESCAPED="$__SED_JSON_ESCAPED$s"
+}
 
+# only done when the bootstrap container is actually needed
+prepare_bootstrap() {
+ __trace begin prepare-bootstrap
+ # the bootstrap and final configs are pre-rendered at build time; only the
+ # user namespace mappings and paths are filled in here
+ local rootfs= dir=
+ sed_json_escape "$APPDIR/bootstrap/rootfs"; rootfs=$__SED_JSON_ESCAPED
+ sed_json_escape "$BOOTSTRAP_BUNDLE"; dir=$__SED_JSON_ESCAPED
+ sed \
+  -e "s|@ELEMENTS_UID@|$__UID|g" \
+  -e "s|@ELEMENTS_GID@|$__GID|g" \
+  -e "s|@ELEMENTS_BOOTSTRAP_ROOTFS@|$rootfs|g" \
+  -e "s|@ELEMENTS_BOOTSTRAP_DIR@|$dir|g" \
+  "$APPDIR/elements-bootstrap.json" > "$BOOTSTRAP_BUNDLE/config.json"
+ __trace end prepare-bootstrap
+}
+
+# sets __ESCAPED_ARGS to the arguments single-quoted for `eval`
 escape_args() {
- printf "'"; printf '%s' "$1" | sed -e "s/'/'\\\\''/g"; printf "'"
- shift
- for i; do
-  printf ' '
-  printf "'"; printf '%s' "$i" | sed -e "s/'/'\\\\''/g"; printf "'"
+ local arg= quoted= pre=
+ __ESCAPED_ARGS=
+ for arg; do
+  quoted=
+  while :; do
+   case "$arg" in
+    *\'*) ;;
+    *) break;;
+   esac
+   pre=${arg%%\'*}
+   arg=${arg#*\'}
+   quoted="$quoted$pre'\\''"
+  done
+  __ESCAPED_ARGS="$__ESCAPED_ARGS${__ESCAPED_ARGS:+ }'$quoted$arg'"
  done
 }
 
 run_bootstrap() {
  set +e
- escape_args "$@" | runc run --no-pivot -b "$BOOTSTRAP_BUNDLE" \
-  "__elements-bootstrap.$__CONFIG_NAME.$(random_12)"
+ random_12
+ escape_args "$@"
+ printf '%s' "$__ESCAPED_ARGS" | runc run --no-pivot -b "$BOOTSTRAP_BUNDLE" \
+  "__elements-bootstrap.$__CONFIG_NAME.$__RANDOM_12"
  local r=$?
  set -e
  return $r
 }
 
+run_jq_direct() {
+ # jq and its libraries are linked against musl, so they are run through
+ # the bootstrap rootfs's dynamic linker, which works on any host
+ local root="$APPDIR/bootstrap/rootfs"
+ local ld=
+ for ld in "$root"/lib/ld-musl-*.so.1; do
+  break
+ done
+ if ! [ -f "$ld" ] || ! [ -f "$root/usr/bin/jq" ]; then
+  echo "elements: error: could not find jq in the AppImage" >&2
+  return 127
+ fi
+ "$ld" --library-path "$root/lib:$root/usr/lib" "$root/usr/bin/jq" "$@"
+}
+
+# sets __REALDIR to the absolute path of the directory $1, using the cd
+# builtin instead of a `$(cd ...; pwd)` subshell
+realdir() {
+ local dir="$1"
+ case "$dir" in
+  /*) ;;
+  *) dir="./$dir";;  # keeps CDPATH out of it
+ esac
+ cd -- "$dir" || return
+ __REALDIR=$PWD
+ cd -- "$__PWD"
+}
+
+# sets __ABSPATH to the absolute path of $1, with its directory resolved
+# like `$(cd "$(dirname -- "$1")"; pwd)/$(basename -- "$1")` but without
+# forking; if the directory does not exist, $1 is just made absolute
 abspath() {
- printf '%s\n' \
-  "$(cd "$(dirname -- "$1")"; printf '%s' "$(pwd)")/$(basename -- "$1")"
+ local path="$1" dir= base=
+ while :; do
+  case "$path" in
+   ?*/) path=${path%/};;
+   *) break;;
+  esac
+ done
+ case "$path" in
+  */*) dir=${path%/*}; base=${path##*/};;
+  *) dir=.; base=$path;;
+ esac
+ if realdir "${dir:-/}" 2>/dev/null; then
+  __ABSPATH="${__REALDIR%/}/$base"
+ else
+  case "$path" in
+   /*) __ABSPATH=$path;;
+   *) __ABSPATH="$__PWD/$path";;
+  esac
+ fi
+}
+
+# With pool-size set, copy-mode copyups are made ahead of time in POOL_DIR
+# as `ready.*/copyup`.  `claim_copyup DEST` moves one of them to DEST,
+# which is atomic since they are on the same filesystem, so concurrent
+# launches can never claim the same one.  `refill_pool` then makes new ones
+# in the background.  Pools are per build, so a rebuilt AppImage never gets
+# an old rootfs.  Each pool's `owner` file holds the path of the AppImage
+# (or AppDir) that made it, and `refill_pool` removes the pools of earlier
+# builds at the same path, which would otherwise stay in memory for good.
+POOL_DIR="$SHM_ROOT/.@pool.$__CONFIG_BUILD_ID"
+POOL_OWNER=${APPIMAGE:-$APPDIR}
+
+claim_copyup() {
+ local entry=
+ for entry in "$POOL_DIR"/ready.*; do
+  if mv "$entry/copyup" "$1" 2>/dev/null; then
+   rmdir "$entry" 2>/dev/null || true
+   return 0
+  fi
+ done
+ return 1
+}
+
+refill_pool() {
+ trap - INT TERM 0
+ set +e
+ mkdir -m 0700 -p "$SHM_ROOT" "$POOL_DIR" || return
+ 
+ # the lock is a directory holding the refiller's PID; a stale lock is
+ # broken once, and whoever breaks it refills
+ if ! mkdir "$POOL_DIR/.lock" 2>/dev/null; then
+  local pid=
+  read -r pid 2>/dev/null < "$POOL_DIR/.lock/pid" || true
+  if [ x"$pid" = x"" ] || kill -0 "$pid" 2>/dev/null; then
+   return
+  fi
+  rm -rf "$POOL_DIR/.lock"
+  mkdir "$POOL_DIR/.lock" 2>/dev/null || return
+ fi
+ sh -c 'echo $PPID' > "$POOL_DIR/.lock/pid"
+ printf '%s\n' "$POOL_OWNER" > "$POOL_DIR/owner"
+ 
+ local pool= owner=
+ for pool in "$SHM_ROOT"/.@pool.*; do
+  if [ x"$pool" = x"$POOL_DIR" ] || ! [ -f "$pool/owner" ]; then
+   continue
+  fi
+  owner=
+  read -r owner 2>/dev/null < "$pool/owner" || true
+  if [ x"$owner" = x"$POOL_OWNER" ] && ! gc_alive "$pool/.lock/pid"; then
+   chmod -R +w "$pool" 2>/dev/null
+   rm -rf "$pool"
+  fi
+ done
+ 
+ local count=0
+ local entry=
+ for entry in "$POOL_DIR"/ready.*; do
+  if [ -d "$entry/copyup" ]; then
+   count=$(($count + 1))
+  fi
+ done
+ 
+ # the AppImage may be unmounted once the container exits, so this can be
+ # cut short; the partial copy is then removed and the next launch refills
+ while [ $count -lt $__CONFIG_POOL_SIZE ]; do
+  entry=$(mktemp -d "$POOL_DIR/tmp.XXXXXX") || break
+  if cp -pPR "$APPDIR/rootfs" "$entry/copyup" && chmod 0700 "$entry/copyup"; then
+   mv "$entry" "$POOL_DIR/ready.${entry##*/tmp.}" || break
+   count=$(($count + 1))
+  else
+   chmod -R +w "$entry" 2>/dev/null
+   rm -rf "$entry"
+   break
+  fi
+ done
+ 
+ rm -rf "$POOL_DIR/.lock"
 }
 
 
 # configure container  #{{{2
 
+# `_jq [--arg name value | --argjson name json]... filter` queues an edit;
+# `_jq_flush` then applies all queued edits with a single jq run, so the
+# bootstrap container is only started once no matter how many edits there are.
+# Each edit's variables are renamed to `$__jq_N` and bound back to their
+# original names with `as`, so edits cannot see each other's variables.
+
+__JQ_ARGS=
+__JQ_FILTER=.
+__JQ_N=0
+
 _jq() {
- cp "$BOOTSTRAP_BUNDLE/final.json" "$BOOTSTRAP_BUNDLE/rootfs/final.json"
- set +e
- run_bootstrap jq "$@" "/final.json" > "$BOOTSTRAP_BUNDLE/tmp.json"
- set -e
- mv "$BOOTSTRAP_BUNDLE/tmp.json" "$BOOTSTRAP_BUNDLE/final.json"
+ local __jq_bindings=
+ while [ $# -gt 1 ]; do
+  case "$1" in
+   --arg|--argjson)
+    __JQ_N=$(($__JQ_N + 1))
+    escape_args "$1" "__jq_$__JQ_N" "$3"
+    __JQ_ARGS="$__JQ_ARGS $__ESCAPED_ARGS"
+    __jq_bindings="$__jq_bindings\$__jq_$__JQ_N as \$$2 | "
+    shift 3
+    ;;
+   *)
+    echo "elements: error: _jq: unsupported option \`$1\`" >&2
+    exit 127
+    ;;
+  esac
+ done
+ __JQ_FILTER="$__JQ_FILTER |
+ ($__jq_bindings$1)"
 }
 
-cp "$BOOTSTRAP_BUNDLE/config.json" "$BOOTSTRAP_BUNDLE/final.json"
+_jq_flush() {
+ local r=0
+ printf '%s\n' "$__JQ_FILTER" > "$BOOTSTRAP_BUNDLE/final.jq"
+ 
+ local cache_entry=
+ if [ $__CONFIG_CONFIG_CACHE_SIZE -gt 0 ]; then
+  printf '%s\n' "$__JQ_ARGS" "$__JQ_FILTER" > "$BOOTSTRAP_BUNDLE/final.key"
+  cache_entry=$(cksum < "$BOOTSTRAP_BUNDLE/final.key")
+  cache_entry="$CONFIG_CACHE_DIR/$__CONFIG_BUILD_ID.${cache_entry%% *}.${cache_entry#* }"
+  # another launch may evict the entry at any point here, in which case
+  # this falls through to running jq
+  if [ -f "$cache_entry/config.json" ] && \
+     cmp -s "$cache_entry/key" "$BOOTSTRAP_BUNDLE/final.key" && \
+     cp "$cache_entry/config.json" "$BOOTSTRAP_BUNDLE/cached.json" 2>/dev/null; then
+   mv "$BOOTSTRAP_BUNDLE/cached.json" "$BOOTSTRAP_BUNDLE/final.json"
+   touch "$cache_entry" 2>/dev/null || true
+   __trace begin config-cache-hit
+   __trace end config-cache-hit
+   __JQ_ARGS=
+   __JQ_FILTER=.
+   return
+  fi
+ fi
+ 
+ __trace begin jq
+ eval "set -- $__JQ_ARGS"
+ if [ x"$__CONFIG_CONFIG_BACKEND" = x"direct" ]; then
+  run_jq_direct "$@" -f "$BOOTSTRAP_BUNDLE/final.jq" "$BOOTSTRAP_BUNDLE/final.json" \
+   > "$BOOTSTRAP_BUNDLE/tmp.json" || r=$?
+ else
+  prepare_bootstrap
+  run_bootstrap jq "$@" -f "/tmp/final.jq" "/tmp/final.json" \
+   > "$BOOTSTRAP_BUNDLE/tmp.json" || r=$?
+ fi
+ if [ $r -ne 0 ]; then
+  echo "elements: error: could not configure the container" >&2
+  exit 127
+ fi
+ mv "$BOOTSTRAP_BUNDLE/tmp.json" "$BOOTSTRAP_BUNDLE/final.json"
+ __JQ_ARGS=
+ __JQ_FILTER=.
+ __trace end jq
+ 
+ if [ x"$cache_entry" != x"" ]; then
+  store_config "$cache_entry" || true
+ fi
+}
 
+# With config-cache-size set, final configs are kept in CONFIG_CACHE_DIR,
+# keyed by the build ID and all of the queued jq arguments and edits, which
+# is everything the config depends on other than the per-run values that are
+# filled in by `fill_config`.  Entries are written config first and key last,
+# so a half-written entry never matches.  The least recently used entries
+# are evicted when there are more than config-cache-size of them.
+CONFIG_CACHE_DIR="$STATE_ROOT/.@config-cache"
+
+store_config() {
+ mkdir -m 0700 -p "$CONFIG_CACHE_DIR"
+ if mkdir -m 0700 "$1" 2>/dev/null; then
+  cp "$BOOTSTRAP_BUNDLE/final.json" "$1/.config.json" && \
+   mv "$1/.config.json" "$1/config.json" && \
+   cp "$BOOTSTRAP_BUNDLE/final.key" "$1/.key" && \
+   mv "$1/.key" "$1/key"
+ fi
+ 
+ local entry=
+ for entry in $(ls -1t "$CONFIG_CACHE_DIR" | tail -n +$(($__CONFIG_CONFIG_CACHE_SIZE + 1))); do
+  rm -rf "$CONFIG_CACHE_DIR/$entry"
+ done
+}
 
-__CONFIG_OUTPUT=
+# per-run values are rendered as placeholders so that cached configs can be
+# reused by later runs
+fill_config() {
+ local appdir= bundle= shm= out_tmp=
+ sed_json_escape "$APPDIR"; appdir=$__SED_JSON_ESCAPED
+ sed_json_escape "$FINAL_BUNDLE_PATH"; bundle=$__SED_JSON_ESCAPED
+ sed_json_escape "$SHM_DIR_PATH"; shm=$__SED_JSON_ESCAPED
+ sed_json_escape "$OUT_TMP_DIR"; out_tmp=$__SED_JSON_ESCAPED
+ sed \
+  -e "s|@ELEMENTS_RUN_ID@|$ELEMENTS_ID|g" \
+  -e "s|@ELEMENTS_RUN_INSTANCE@|$ELEMENTS_INSTANCE|g" \
+  -e "s|@ELEMENTS_RUN_APPDIR@|$appdir|g" \
+  -e "s|@ELEMENTS_RUN_BUNDLE@|$bundle|g" \
+  -e "s|@ELEMENTS_RUN_SHM@|$shm|g" \
+  -e "s|@ELEMENTS_RUN_OUT_TMP@|$out_tmp|g" \
+  "$BOOTSTRAP_BUNDLE/final.json" > "$BOOTSTRAP_BUNDLE/tmp.json"
+ mv "$BOOTSTRAP_BUNDLE/tmp.json" "$BOOTSTRAP_BUNDLE/final.json"
+}
 
-config_misc
-config_args "$@"
-config_env
-config_binds
+cp "$APPDIR/elements-config.json" "$BOOTSTRAP_BUNDLE/final.json"
 
 
-if ! (printf '%s\n' "$ELEMENTS_NAME" | grep -q -e '^[0-9a-zA-Z_+.-]\+$'); then
- echo "elements: error: \`$ELEMENTS_NAME\` is not a valid container app name" >&2
- exit 2
-fi
-if ! (printf '%s\n' "$ELEMENTS_INSTANCE" | grep -q -e '^[%0-9a-zA-Z_+.-]*$'); then
- echo "elements: error: \`$ELEMENTS_INSTANCE\` is not a valid instance ID" >&2
- exit 2
-fi
+__CONFIG_OUTPUT=
 
-ELEMENTS_INSTANCE=$(printf '%s\n' "${ELEMENTS_INSTANCE:-%}" |
- awk -v random_12="$(random_12)" \
- '{ gsub(/%/, random_12); print }')
+__trace begin configure
+__trace_call config_args "$@"
+__trace_call config_env
+__trace_call config_binds
+
+
+case "$ELEMENTS_NAME" in
+ ''|*[!0-9a-zA-Z_+.-]*)
+  echo "elements: error: \`$ELEMENTS_NAME\` is not a valid container app name" >&2
+  exit 2
+  ;;
+esac
+case "$ELEMENTS_INSTANCE" in
+ *[!%0-9a-zA-Z_+.-]*)
+  echo "elements: error: \`$ELEMENTS_INSTANCE\` is not a valid instance ID" >&2
+  exit 2
+  ;;
+esac
+
+# each `%` is replaced with the same random string
+ELEMENTS_INSTANCE=${ELEMENTS_INSTANCE:-%}
+case "$ELEMENTS_INSTANCE" in
+ *%*) random_12;;
+esac
+while :; do
+ case "$ELEMENTS_INSTANCE" in
+  *%*) ELEMENTS_INSTANCE=${ELEMENTS_INSTANCE%%\%*}$__RANDOM_12${ELEMENTS_INSTANCE#*\%};;
+  *) break;;
+ esac
+done
 
 ELEMENTS_ID="$ELEMENTS_NAME.$ELEMENTS_INSTANCE"
 FINAL_BUNDLE_PATH="$STATE_ROOT/$ELEMENTS_ID"
@@ -250,125 +807,120 @@ SHM_DIR_PATH="$SHM_ROOT/$ELEMENTS_ID"
 # we must actually make the tmpdir here because mktemp(1) is used
 if [ $__CONFIG__DO_OUTPUT -ne 0 ]; then
  out_dir=${__CONFIG_OUTPUT:-.}
- if ! [ -d "$out_dir" ]; then
-  out_dir=$(dirname -- "$out_dir")
+ if [ x"$out_dir" = x"-" ]; then
+  # streamed to stdout, so nothing is ever moved out of the tmpdir
+  out_dir=${TMPDIR:-/tmp}
+ elif ! [ -d "$out_dir" ]; then
+  abspath "$out_dir"
+  out_dir=${__ABSPATH%/*}
+  out_dir=${out_dir:-/}
  fi
- out_dir=$(cd "$out_dir" && pwd)
+ realdir "$out_dir"
+ out_dir=$__REALDIR
  OUT_TMP_DIR_PATH="$out_dir/.elements-out-tmp.$ELEMENTS_ID.XXXXXX"
  OUT_TMP_DIR_PATH=$(mktemp -d "$OUT_TMP_DIR_PATH")
  chmod 0700 "$OUT_TMP_DIR_PATH"
  OUT_TMP_DIR=$OUT_TMP_DIR_PATH
 fi
 
-RUNC_HOSTNAME=$(hostname 2>/dev/null || echo "${HOSTNAME:-Elements}")
+RUNC_HOSTNAME=
+read -r RUNC_HOSTNAME 2>/dev/null < /proc/sys/kernel/hostname || true
+RUNC_HOSTNAME=${RUNC_HOSTNAME:-${HOSTNAME:-Elements}}
 
-_jq \
- --arg env_magic "ELEMENTS_MAGIC=$ELEMENTS_MAGIC" \
- --arg env_instance "ELEMENTS_INSTANCE=$ELEMENTS_INSTANCE" \
- --arg env_id "ELEMENTS_ID=$ELEMENTS_ID" \
- --arg env_term "TERM=${TERM:-xterm}" \
- --arg env_hostname "HOSTNAME=$RUNC_HOSTNAME" \
- '.process.env |= (. | map(select(.|startswith("TERM=")|not))) + [
-  $env_magic,
-  $env_instance,
-  $env_id,
-  $env_term,
-  $env_hostname
- ]'
-
-
-basic_mounts='{
- "destination": "/tmp",
- "type": "tmpfs",
- "source": "tmpfs",
- "options": ["nosuid", "nodev", "size=16384k"]
-}'
-
-if [ $__CONFIG_RESOLV -ne 0 ] && [ -f /etc/resolv.conf ]; then
- basic_mounts="$basic_mounts,"'{
-  "destination": "/etc/resolv.conf",
-  "type": "bind",
-  "source": "/etc/resolv.conf",
-  "options": ["rbind"]
- }'
-fi
-
-if [ $__CONFIG__DO_OUTPUT -ne 0 ]; then
- basic_mounts="$basic_mounts,"'{
-  "destination": "/out",
-  "type": "bind",
-  "source": $out_out,
-  "options": ["rbind"]
- },{
-  "destination": "/tmp/out",
-  "type": "bind",
-  "source": $out_tmp,
-  "options": ["rbind"]
- }'
+if [ $__CONFIG_RESOLV -ne 0 ] && ! [ -f /etc/resolv.conf ]; then
+ _jq '.mounts |= map(select(.source != "/etc/resolv.conf"))'
 fi
 
-_jq --arg out_out "$OUT_TMP_DIR/out" --arg out_tmp "$OUT_TMP_DIR/tmp" \
- '.mounts |= . + ['"$basic_mounts"']'
-
 if ! [ -t 0 ]; then
  __CONFIG_TERMINAL=false
 fi
 
 JQ_SHM_PATH=
 
-RUNC_ROOTFS="$APPDIR/rootfs"
+RUNC_ROOTFS="@ELEMENTS_RUN_APPDIR@/rootfs"
 if [ $__CONFIG_ROOT_COPYUP -ne 0 ]; then
- RUNC_ROOTFS="$SHM_DIR_PATH/copyup"
- JQ_SHM_PATH=$SHM_DIR_PATH
+ RUNC_ROOTFS="@ELEMENTS_RUN_SHM@/copyup"
+ JQ_SHM_PATH=@ELEMENTS_RUN_SHM@
 fi
 
 JQ_PWD=
 JQ_OUTPUT=
 JQ_OUT_TMP_DIR=
+JQ_CLEANUP_OUT_TMP_DIR=
 if [ $__CONFIG__DO_OUTPUT -ne 0 ]; then
  JQ_PWD=$__PWD
  JQ_OUTPUT=${__CONFIG_OUTPUT:-.}
- JQ_SHM_PATH=$SHM_DIR_PATH
- JQ_OUT_TMP_DIR=$OUT_TMP_DIR
+ JQ_SHM_PATH=@ELEMENTS_RUN_SHM@
+ JQ_OUT_TMP_DIR=@ELEMENTS_RUN_OUT_TMP@
+ JQ_CLEANUP_OUT_TMP_DIR=@ELEMENTS_RUN_OUT_TMP@
+ if [ x"$__CONFIG_OUTPUT" = x"-" ]; then
+  # streamed by the loader after the hooks have run (see the end)
+  JQ_OUTPUT=
+  JQ_CLEANUP_OUT_TMP_DIR=
+ fi
 fi
 
+# everything else (process args, mounts, hook layout, etc.) is already
+# in the pre-rendered config; values that differ between runs even with the
+# same arguments are filled in by `fill_config`
 _jq \
- --arg cmd "/.elements-entry" \
+ --argjson uid "$__UID" \
+ --argjson gid "$__GID" \
+ --arg env_magic "ELEMENTS_MAGIC=$ELEMENTS_MAGIC" \
+ --arg env_instance "ELEMENTS_INSTANCE=@ELEMENTS_RUN_INSTANCE@" \
+ --arg env_id "ELEMENTS_ID=@ELEMENTS_RUN_ID@" \
+ --arg env_term "TERM=${TERM:-xterm}" \
+ --arg env_hostname "HOSTNAME=$RUNC_HOSTNAME" \
  --argjson terminal $__CONFIG_TERMINAL \
  --arg hostname "$RUNC_HOSTNAME" \
  --arg rootfs "$RUNC_ROOTFS" \
- --arg output_hook "$APPDIR/elements-output.sh" \
+ --arg appdir "@ELEMENTS_RUN_APPDIR@" \
  --arg argv0 "$ELEMENTS_ARGV0" \
- --arg id "$ELEMENTS_ID" \
+ --arg id "@ELEMENTS_RUN_ID@" \
  --arg pwd "$JQ_PWD" \
  --arg output "$JQ_OUTPUT" \
- --arg cleanup_hook "$APPDIR/elements-cleanup.sh" \
- --arg bundle "$FINAL_BUNDLE_PATH" \
+ --arg bundle "@ELEMENTS_RUN_BUNDLE@" \
  --arg shm "$JQ_SHM_PATH" \
  --arg out_tmp "$JQ_OUT_TMP_DIR" \
+ --arg cleanup_out_tmp "$JQ_CLEANUP_OUT_TMP_DIR" \
  '
-  .process.args[0]=$cmd |
+  .linux.uidMappings[0].hostID=$uid |
+  .linux.gidMappings[0].hostID=$gid |
+  .process.env += [
+   $env_magic,
+   $env_instance,
+   $env_id,
+   $env_term,
+   $env_hostname
+  ] |
   .process.terminal=$terminal |
   .hostname=$hostname |
   .root.path=$rootfs |
-  .root.readonly=false |
-  (.hooks.poststop |= . + [{
-   "path": $output_hook,
-   "args": ["elements-output.sh", $argv0, $id, $out_tmp, "/out", $pwd, $output]
-  },{
-   "path": $cleanup_hook,
-   "args": ["elements-cleanup.sh", $bundle, $shm, $out_tmp]
-  }])
+  (.mounts |= map(
+   if .source == "@ELEMENTS_OUT@" then .source=($out_tmp + "/out")
+   elif .source == "@ELEMENTS_OUT_TMP@" then .source=($out_tmp + "/tmp")
+   else . end
+  )) |
+  (.hooks.poststop |= map(
+   .path=($appdir + "/" + .args[0]) |
+   if .args[0] == "elements-output.sh" then
+    .args += [$argv0, $id, $out_tmp, "/out", $pwd, $output]
+   else
+    .args += [$bundle, $shm, $cleanup_out_tmp]
+   end
+  ))
  '
 
+__trace end configure
 
-# cleanup bootstrap environment  #{{{2
-
-rm -rf "$BOOTSTRAP_BUNDLE/rootfs"
+_jq_flush
+__trace_call fill_config
 
 
 # prepare final bundle  #{{{2
 
+__trace begin final-bundle
+
 if [ -e "$FINAL_BUNDLE_PATH" ]; then
  echo "elements: error: a container with ID \`$ELEMENTS_ID\` already exists" >&2
  exit 127
@@ -380,7 +932,11 @@ printf '%s\n' "$ELEMENTS_MAGIC" > "$FINAL_BUNDLE/magic"
 printf '%s\n' "$ELEMENTS_NAME" > "$FINAL_BUNDLE/name"
 printf '%s\n' "$ELEMENTS_INSTANCE" > "$FINAL_BUNDLE/instance"
 printf '%s\n' "$ELEMENTS_ID" > "$FINAL_BUNDLE/id"
+printf '%s\n' $$ > "$FINAL_BUNDLE/loader-pid"  # this becomes runc's PID
 ln -s "$APPDIR" "$FINAL_BUNDLE/appdir"
+if [ x"$OUT_TMP_DIR" != x"" ]; then
+ ln -s "$OUT_TMP_DIR" "$FINAL_BUNDLE/out_tmp"
+fi
 
 if [ $__CONFIG_ROOT_COPYUP -ne 0 ] || [ $__CONFIG__DO_OUTPUT -ne 0 ]; then
  mkdir -m 0700 -p "$SHM_ROOT"
@@ -389,9 +945,31 @@ if [ $__CONFIG_ROOT_COPYUP -ne 0 ] || [ $__CONFIG__DO_OUTPUT -ne 0 ]; then
  ln -s "$SHM_DIR" "$FINAL_BUNDLE/shm"
 fi
 
+if [ $__CONFIG_ROOT_COPYUP -ne 0 ] && [ x"$__CONFIG_ROOT_COPYUP_MODE" = x"overlay" ]; then
+ if ! command -v fuse-overlayfs >/dev/null 2>&1; then
+  echo "elements: warning: fuse-overlayfs is not installed; copying the root filesystem" >&2
+  __CONFIG_ROOT_COPYUP_MODE=copy
+ fi
+fi
+
 if [ $__CONFIG_ROOT_COPYUP -ne 0 ]; then
- cp -pPR "$APPDIR/rootfs" "$SHM_DIR/copyup"
- chmod 0700 "$SHM_DIR/copyup"
+ __trace begin copyup
+ if [ x"$__CONFIG_ROOT_COPYUP_MODE" = x"overlay" ]; then
+  # copy-on-write: only files that the container changes end up in shm
+  mkdir -m 0700 "$SHM_DIR/upper" "$SHM_DIR/work" "$SHM_DIR/copyup"
+  fuse-overlayfs \
+   -o "lowerdir=$APPDIR/rootfs,upperdir=$SHM_DIR/upper,workdir=$SHM_DIR/work" \
+   "$SHM_DIR/copyup"
+ else
+  if [ $__CONFIG_POOL_SIZE -le 0 ] || ! claim_copyup "$SHM_DIR/copyup"; then
+   cp -pPR "$APPDIR/rootfs" "$SHM_DIR/copyup"
+   chmod 0700 "$SHM_DIR/copyup"
+  fi
+  if [ $__CONFIG_POOL_SIZE -gt 0 ]; then
+   refill_pool </dev/null >/dev/null 2>&1 &
+  fi
+ fi
+ __trace end copyup
 fi
 
 if [ $__CONFIG__DO_OUTPUT -ne 0 ]; then
@@ -404,9 +982,54 @@ mv "$BOOTSTRAP_BUNDLE/final.json" "$FINAL_BUNDLE/config.json"
 rm -rf "$BOOTSTRAP_BUNDLE"
 BOOTSTRAP_BUNDLE=
 
+__trace end final-bundle
+
 
 # run container  #{{{2
 
+__trace end loader
+__trace begin runc-run
+
+if [ x"$__CONFIG_OUTPUT" = x"-" ]; then
+ # /out is streamed to stdout as a tar archive once the container exits, so
+ # runc is not exec()ed here, and the container's own stdout goes to stderr
+ # to keep it out of the archive.  runc runs in the background so that
+ # INT and TERM can be passed on to it as if it had been exec()ed, instead
+ # of waiting for it and then running `cleanup`; the output is still
+ # streamed afterwards.  (Background jobs get /dev/null as their stdin,
+ # hence fd 3.)
+ exec 3<&0
+ runc run \
+  --pid-file "$FINAL_BUNDLE/pid" \
+  -b "$FINAL_BUNDLE" \
+  "$ELEMENTS_ID" <&3 >&2 3<&- &
+ __RUNC_PID=$!
+ exec 3<&-
+ trap 'kill -TERM $__RUNC_PID 2>/dev/null || true' TERM
+ trap 'kill -INT $__RUNC_PID 2>/dev/null || true' INT
+ 
+ # wait(1) returns early when a trapped signal arrives
+ while :; do
+  r=0
+  wait $__RUNC_PID || r=$?
+  if ! kill -0 $__RUNC_PID 2>/dev/null; then
+   break
+  fi
+ done
+ __trace end runc-run
+ 
+ if ! tar -C "$OUT_TMP_DIR/out" -cf - .; then
+  if [ -d "$OUT_TMP_DIR/out" ]; then
+   echo "elements: error: could not write the output to stdout; it was left in \`$OUT_TMP_DIR/out\`" >&2
+   OUT_TMP_DIR=
+  else
+   echo "elements: error: could not write the output to stdout" >&2
+  fi
+  exit 1
+ fi
+ exit $r
+fi
+
 exec runc run \
  --pid-file "$FINAL_BUNDLE/pid" \
  -b "$FINAL_BUNDLE" \
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# vim: set fdm=marker sw=1:
+
+# Benchmarks for Elements.
+#
+# Usage (from the repo root, after `make`):
+#
+#     test/bench/bench.py [--iterations N] [--scaling 1,10,100,300] ...
+#     test/bench/bench.py --compare OLD.json [NEW.json]
+#
+# This measures:
+#
+# * loader compile time for synthetic definition files with growing numbers
+#   of args, env vars, and binds (no root needed);
+# * build time for the example elements in test/ and the synthetic ones,
+#   using `elements --profile` in batch mode (needs root for Singularity;
+#   sudo is used if not running as root);
+# * warm and cold launch latency (p50/p95/p99) of the built elements over
+#   many iterations, including copyup vs. non-copyup; cold runs drop the
+#   AppImage from the page cache with posix_fadvise() before each launch.
+#
+# Results are written as JSON to test/bench/results/, and --compare prints
+# the change between two result files (the latest one by default).
+
+# imports  {{{1
+import argparse
+import datetime
+import glob
+import importlib.machinery
+import importlib.util
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from collections import OrderedDict
+from typing import *
+
+
+# constants  {{{1
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(os.path.dirname(BENCH_DIR))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+WORK_DIR = os.path.join(BENCH_DIR, "work")
+
+# example elements to build and launch, with the arguments and environment
+# that `make test` uses
+EXAMPLES = OrderedDict([
+ ("simple", ([], {})),
+ ("copyup", ([], {})),
+ ("parsing", (
+  ["-v", "{test}/parsing/docroot", "-H", "spam", "2629", "-d", "{test}/parsing/data"],
+  {"HOST_VAR": "1234", "TRUTHY": "yes", "FALSY": "0", "EMPTY": "", "YOUR_FACE": "no"},
+ )),
+])
+
+SYNTHETIC_DEF = """
+#Elements.name: bench-items-{n}
+#Elements.args: {args}
+#Elements.env: {env}
+#Elements.bind: {binds}
+#Elements.root-copyup: {copyup}
+
+Bootstrap: docker
+From: alpine
+
+
+%runscript
+ exit 0
+""".lstrip()
+
+
+def main(argv: List[str]) -> int:  #{{{1
+ p = argparse.ArgumentParser(prog=os.path.basename(argv[0]))
+ p.add_argument("--elements", metavar="PATH", default=os.path.join(REPO_DIR, "elements"),
+                help="the built elements script (default: ./elements)")
+ p.add_argument("-n", "--iterations", metavar="N", type=int, default=50,
+                help="launches per element and mode (default: 50)")
+ p.add_argument("--scaling", metavar="N,...", default="1,10,100,300",
+                help="numbers of args, env vars, and binds in synthetic defs"
+                     " (default: 1,10,100,300)")
+ p.add_argument("--launch-scaling", metavar="N,...", default="1,10,100",
+                help="synthetic defs to also build and launch (default: 1,10,100)")
+ p.add_argument("-j", "--jobs", metavar="N", type=int, default=os.cpu_count() or 1,
+                help="parallel builds (default: number of CPUs)")
+ p.add_argument("--skip-build", action="store_true",
+                help="launch elements from a previous run's work directory")
+ p.add_argument("--no-launch", action="store_true",
+                help="only benchmark compiling and building")
+ p.add_argument("-o", "--output", metavar="FILE", default=None,
+                help="where to write the results (default: a new file in test/bench/results)")
+ p.add_argument("--compare", metavar="FILE", nargs="+", default=None,
+                help="compare two result files (or one with the latest) and exit")
+ options = p.parse_args(argv[1:])
+
+ if options.compare:
+  return compare(options.compare)
+
+ scaling = [int(i) for i in options.scaling.split(",") if i]
+ launch_scaling = [int(i) for i in options.launch_scaling.split(",") if i]
+ elements = load_elements(options.elements)
+
+ results: Dict[str, Any] = OrderedDict()
+ results["meta"] = meta(elements)
+
+ os.makedirs(WORK_DIR, exist_ok=True)
+ bind_dir = os.path.join(WORK_DIR, "binds")
+ make_bind_dir(bind_dir, max(scaling + launch_scaling + [0]))
+
+ # compile  #{{{2
+ results["compile"] = OrderedDict()
+ for n in scaling:
+  def_ = synthetic_def(n, copyup=False).encode("utf-8")
+  timings = []
+  for i in range(max(options.iterations // 5, 3)):
+   start = time.perf_counter()
+   with tempfile.TemporaryDirectory() as tmp:
+    el = elements.Element(def_)
+    el._parse(tmpdir=tmp)
+    el._compile_loader()
+    el._compile_config()
+   timings += [time.perf_counter() - start]
+  results["compile"]["items-%d" % n] = stats(timings)
+  print("compile items-%d: p50 %.1f ms" % (n, results["compile"]["items-%d" % n]["p50"] * 1000),
+        file=sys.stderr)
+
+ # build  #{{{2
+ defs_dir = os.path.join(WORK_DIR, "defs")
+ out_dir = os.path.join(WORK_DIR, "out")
+
+ launches: Dict[str, Tuple[str, List[str], Dict[str, str]]] = OrderedDict()
+ for name, (args, env) in EXAMPLES.items():
+  test_dir = os.path.join(REPO_DIR, "test")
+  launches[name] = (os.path.join(out_dir, name),
+                    [i.format(test=test_dir) for i in args], env)
+ for n in launch_scaling:
+  for copyup in (False, True):
+   name = "items-%d%s" % (n, "-copyup" if copyup else "")
+   launches[name] = (os.path.join(out_dir, name),
+                     ["value"] * n, {"BENCH_BIND_DIR": bind_dir})
+
+ if not options.skip_build:
+  if os.path.isdir(defs_dir):
+   shutil.rmtree(defs_dir)
+  os.makedirs(defs_dir)
+  defs = [os.path.join(REPO_DIR, "test", name, "element.def") for name in EXAMPLES]
+  for n in launch_scaling:
+   for copyup in (False, True):
+    def_path = os.path.join(defs_dir, "items-%d%s.def" % (n, "-copyup" if copyup else ""))
+    with open(def_path, "w") as f:
+     f.write(synthetic_def(n, copyup))
+    defs += [def_path]
+
+  results["build"] = build(options.elements, defs, out_dir, options.jobs)
+
+ # launch  #{{{2
+ if not options.no_launch:
+  results["launch"] = OrderedDict()
+  for name, (image, args, env) in launches.items():
+   if not os.path.exists(image):
+    print("launch %s: skipped (`%s` was not built)" % (name, image), file=sys.stderr)
+    continue
+   results["launch"][name] = OrderedDict()
+   for mode in ("warm", "cold"):
+    r = launch(image, args, env, options.iterations, cold=(mode == "cold"))
+    results["launch"][name][mode] = r
+    print("launch %s (%s): p50 %.1f ms, p95 %.1f ms, p99 %.1f ms%s"
+          % (name, mode, r["p50"] * 1000, r["p95"] * 1000, r["p99"] * 1000,
+             ", %d failed" % r["failed"] if r["failed"] else ""),
+          file=sys.stderr)
+
+ # results  #{{{2
+ output = options.output
+ if not output:
+  os.makedirs(RESULTS_DIR, exist_ok=True)
+  output = os.path.join(RESULTS_DIR, "%s-%s.json" % (
+   datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ"),
+   results["meta"]["version"],
+  ))
+ with open(output, "w") as f:
+  json.dump(results, f, indent=1)
+  f.write("\n")
+ print("Results written to `%s`." % output, file=sys.stderr)
+
+ return 0
+
+
+def load_elements(path: str) -> Any:  #{{{1
+ # imports the built elements script, which has no .py extension
+ loader = importlib.machinery.SourceFileLoader("elements", path)
+ spec = importlib.util.spec_from_loader("elements", loader)
+ assert spec is not None
+ module = importlib.util.module_from_spec(spec)
+ loader.exec_module(module)
+ return module
+
+
+def meta(elements: Any) -> Dict[str, Any]:  #{{{1
+ return OrderedDict([
+  ("version", elements.__version__),
+  ("date", datetime.datetime.now(datetime.timezone.utc).isoformat()),
+  ("host", platform.node()),
+  ("kernel", platform.release()),
+  ("machine", platform.machine()),
+  ("cpus", os.cpu_count()),
+  ("python", platform.python_version()),
+ ])
+
+
+def synthetic_def(n: int, copyup: bool) -> str:  #{{{1
+ # `n` positional args, env vars, and read-only binds
+ return SYNTHETIC_DEF.format(
+  n="%d%s" % (n, "-copyup" if copyup else ""),
+  args=" ".join("arg%d:env>ARG_%d" % (i, i) for i in range(n)),
+  env=" ".join("ENV_%d=value_%d" % (i, i) for i in range(n)),
+  binds=" ".join("$BENCH_BIND_DIR/%d:/mnt/%d:ro" % (i, i) for i in range(n)),
+  copyup="true" if copyup else "false",
+ )
+
+
+def make_bind_dir(path: str, n: int) -> None:  #{{{1
+ os.makedirs(path, exist_ok=True)
+ for i in range(n):
+  with open(os.path.join(path, str(i)), "w") as f:
+   f.write("%d\n" % i)
+
+
+def build(elements_path: str, defs: List[str], out_dir: str,  #{{{1
+          jobs: int) -> Dict[str, Any]:
+ profile = os.path.join(WORK_DIR, "build-profile.json")
+ cmd = [sys.executable, elements_path, "-f", "--profile", profile,
+        "-O", out_dir, "-j", str(jobs)] + defs
+ if os.geteuid() != 0:
+  cmd = ["sudo"] + cmd
+
+ start = time.perf_counter()
+ r = subprocess.run(cmd)
+ wall = time.perf_counter() - start
+
+ result: Dict[str, Any] = OrderedDict()
+ result["wall"] = round(wall, 3)
+ result["jobs"] = jobs
+ result["failed"] = r.returncode != 0
+ result["elements"] = OrderedDict()
+ if os.path.exists(profile):
+  with open(profile, "r") as f:
+   for report in json.load(f):
+    result["elements"][os.path.basename(report["output"])] = report
+ built = [i for i in result["elements"].values() if i.get("built")]
+ result["throughput_per_minute"] = round(len(built) / wall * 60, 3) if wall else None
+ return result
+
+
+def launch(image: str, args: List[str], env: Dict[str, str],  #{{{1
+           iterations: int, cold: bool = False) -> Dict[str, Any]:
+ run_env = dict(os.environ)
+ run_env.update(env)
+
+ timings = []
+ failed = 0
+ for i in range(iterations):
+  if cold:
+   drop_cache(image)
+  start = time.perf_counter()
+  r = subprocess.run([image] + args, env=run_env, stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+  timings += [time.perf_counter() - start]
+  if r.returncode != 0:
+   failed += 1
+
+ result = stats(timings)
+ result["failed"] = failed
+ return result
+
+
+def drop_cache(path: str) -> None:  #{{{1
+ # evicts the (clean) pages of `path` from the page cache
+ fd = os.open(path, os.O_RDONLY)
+ try:
+  os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+ finally:
+  os.close(fd)
+
+
+def stats(timings: List[float]) -> Dict[str, Any]:  #{{{1
+ s = sorted(timings)
+
+ def _percentile(p: float) -> float:
+  # nearest-rank
+  return s[max(0, min(len(s) - 1, math.ceil(p / 100 * len(s)) - 1))]
+
+ return OrderedDict([
+  ("n", len(s)),
+  ("min", round(s[0], 6)),
+  ("p50", round(_percentile(50), 6)),
+  ("p95", round(_percentile(95), 6)),
+  ("p99", round(_percentile(99), 6)),
+  ("max", round(s[-1], 6)),
+  ("mean", round(sum(s) / len(s), 6)),
+ ])
+
+
+def compare(filenames: List[str]) -> int:  #{{{1
+ if len(filenames) == 1:
+  latest = sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")))
+  if not latest:
+   print("bench: error: no results to compare with", file=sys.stderr)
+   return 2
+  filenames = filenames + [latest[-1]]
+
+ old, new = [json.load(open(i, "r")) for i in filenames[:2]]
+ print("%-40s %12s %12s %8s" % ("", "old", "new", "change"))
+
+ def _row(key: str, a: Optional[float], b: Optional[float], unit: str = "ms") -> None:
+  if a is None or b is None:
+   return
+  scale = 1000 if unit == "ms" else 1
+  change = "%+.1f%%" % ((b - a) / a * 100) if a else ""
+  print("%-40s %10.2f%s %10.2f%s %8s" % (key, a * scale, unit, b * scale, unit, change))
+
+ for section in ("compile",):
+  for name in old.get(section, {}):
+   if name in new.get(section, {}):
+    for p in ("p50", "p95"):
+     _row("%s %s %s" % (section, name, p), old[section][name][p], new[section][name][p])
+
+ for name in old.get("launch", {}):
+  for mode in ("warm", "cold"):
+   a = old["launch"][name].get(mode)
+   b = new.get("launch", {}).get(name, {}).get(mode)
+   if a and b:
+    for p in ("p50", "p95", "p99"):
+     _row("launch %s %s %s" % (name, mode, p), a[p], b[p])
+
+ if "build" in old and "build" in new:
+  _row("build wall", old["build"]["wall"], new["build"]["wall"], "s")
+
+ return 0
+
+
+if __name__ == "__main__":  #{{{1
+ try:
+  sys.exit(main(sys.argv))
+ except KeyboardInterrupt:
+  pass
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# vim: set fdm=marker sw=1:
+
+# Offline loader benchmark for Elements.
+#
+# Usage:
+#
+#     test/bench/offline.py [options] APPDIR|APPIMAGE [-- ELEMENT-ARGS...]
+#
+# This runs an element's loader with test/bench/stub/runc in place of runc(8),
+# so it needs neither root nor working containers.  APPDIR is an unpacked
+# element (e.g. the `squashfs-root` made by `ELEMENT --appimage-extract`);
+# if an AppImage is given instead, it is extracted to a temporary directory
+# first.  The bootstrap container's jq edits are run with the host's jq.
+#
+# For each startup, it reports the wall time, the number of runc invocations
+# (by command), and, if strace(1) is installed, the number of forks, execs (by
+# program), and file operations.  Results can be written as JSON with -o, and
+# with --baseline, it exits with status 1 if a startup makes more runc calls
+# than the baseline did, so it can be used to gate loader changes.
+
+# imports  {{{1
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from collections import Counter, OrderedDict
+from typing import *
+
+from bench import stats  # test/bench/bench.py
+
+
+# constants  {{{1
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+STUB_DIR = os.path.join(BENCH_DIR, "stub")
+
+FORK_SYSCALLS = ("clone", "clone3", "fork", "vfork")
+EXEC_SYSCALLS = ("execve", "execveat")
+
+
+def main(argv: List[str]) -> int:  #{{{1
+ p = argparse.ArgumentParser(prog=os.path.basename(argv[0]))
+ p.add_argument("element", metavar="APPDIR|APPIMAGE",
+                help="an unpacked element, or an AppImage to unpack")
+ p.add_argument("-n", "--iterations", metavar="N", type=int, default=20,
+                help="startups to time (default: 20)")
+ p.add_argument("--runc-delay", metavar="SECONDS", default="0",
+                help="simulated time taken by each runc invocation (default: 0)")
+ p.add_argument("--no-strace", action="store_true",
+                help="do not count forks and file operations with strace")
+ p.add_argument("-C", "--cwd", metavar="DIR", default=None,
+                help="directory to run the element in (default: the current directory)")
+ p.add_argument("-o", "--output", metavar="FILE", default=None,
+                help="write the results as JSON to FILE (`-` for standard output)")
+ p.add_argument("--baseline", metavar="FILE", default=None,
+                help="fail if there are more runc invocations than in FILE's results")
+ # everything after `--` goes to the element
+ args = argv[1:]
+ element_args: List[str] = []
+ if "--" in args:
+  element_args = args[args.index("--") + 1:]
+  args = args[:args.index("--")]
+ options = p.parse_args(args)
+ options.args = element_args
+
+ if options.iterations < 1:
+  p.error("--iterations must be at least 1")
+ if not shutil.which("jq"):
+  print("offline: error: jq is needed for the stub runc", file=sys.stderr)
+  return 2
+
+ with tempfile.TemporaryDirectory(prefix="elements-bench.") as tmp:
+  appdir = options.element
+  if not os.path.isdir(appdir):
+   appdir = extract(appdir, tmp)
+  appdir = os.path.abspath(appdir)
+
+  results = bench(appdir, options.args, options, tmp)
+
+ results["element"] = os.path.abspath(options.element)
+ results["args"] = options.args
+ results["runc_delay"] = float(options.runc_delay)
+ report(results)
+
+ if options.output:
+  if options.output == "-":
+   json.dump(results, sys.stdout, indent=1)
+   sys.stdout.write("\n")
+  else:
+   with open(options.output, "w") as f:
+    json.dump(results, f, indent=1)
+    f.write("\n")
+
+ if options.baseline:
+  with open(options.baseline, "r") as f:
+   baseline = json.load(f)
+  if results["runc"]["total"] > baseline["runc"]["total"]:
+   print("offline: error: %d runc invocations per startup, up from %d in `%s`"
+         % (results["runc"]["total"], baseline["runc"]["total"], options.baseline),
+         file=sys.stderr)
+   return 1
+
+ return 0 if not results["failed"] else 1
+
+
+def extract(appimage: str, tmp: str) -> str:  #{{{1
+ appimage = os.path.abspath(appimage)
+ subprocess.run([appimage, "--appimage-extract"], cwd=tmp, check=True,
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+ return os.path.join(tmp, "squashfs-root")
+
+
+def bench(appdir: str, args: List[str],  #{{{1
+          options: argparse.Namespace, tmp: str) -> Dict[str, Any]:
+ runtime_dir = os.path.join(tmp, "runtime")
+ os.mkdir(runtime_dir, 0o700)
+ runc_log = os.path.join(tmp, "runc.log")
+
+ env = dict(os.environ)
+ env.update({
+  "APPDIR": appdir,
+  "ARGV0": os.path.basename(options.element.rstrip("/")),
+  "PATH": STUB_DIR + os.pathsep + env.get("PATH", os.defpath),
+  "XDG_RUNTIME_DIR": runtime_dir,
+  "ELEMENTS_BENCH_RUNC_LOG": runc_log,
+  "ELEMENTS_BENCH_RUNC_DELAY": options.runc_delay,
+ })
+ cmd = ["sh", os.path.join(appdir, "AppRun")] + args
+
+ def _run(prefix: List[str] = []) -> Tuple[float, int, List[str]]:
+  if os.path.exists(runc_log):
+   os.unlink(runc_log)
+  start = time.perf_counter()
+  r = subprocess.run(prefix + cmd, env=env, cwd=options.cwd,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.PIPE)
+  wall = time.perf_counter() - start
+  if r.returncode != 0:
+   sys.stderr.buffer.write(r.stderr)
+  calls = []
+  if os.path.exists(runc_log):
+   with open(runc_log, "r") as f:
+    calls = f.read().splitlines()
+  return wall, r.returncode, calls
+
+ # timed runs  #{{{2
+ timings = []
+ failed = 0
+ calls: List[str] = []
+ for i in range(options.iterations):
+  wall, status, calls = _run()
+  timings += [wall]
+  failed += status != 0
+
+ result: Dict[str, Any] = OrderedDict()
+ result["failed"] = failed
+ result["wall"] = stats(timings)
+ result["runc"] = OrderedDict([
+  ("total", len(calls)),
+  ("by_command", OrderedDict(sorted(Counter(i.split(" ", 1)[0] for i in calls).items()))),
+  ("calls", calls),
+ ])
+
+ # traced run  #{{{2
+ if not options.no_strace:
+  if not shutil.which("strace"):
+   print("offline: warning: strace not found; not counting forks and file operations",
+         file=sys.stderr)
+  else:
+   trace = os.path.join(tmp, "strace.log")
+   _run(["strace", "-f", "-qq", "-o", trace, "-e", "trace=process,file"])
+   result["syscalls"] = count_syscalls(trace)
+
+ return result
+
+
+def count_syscalls(trace: str) -> Dict[str, Any]:  #{{{1
+ by_syscall: Counter = Counter()
+ execs: Counter = Counter()
+ line_re = re.compile(r"^\d+\s+(\w+)\((.*)$")
+ with open(trace, "r", errors="replace") as f:
+  for line in f:
+   m = line_re.match(line)
+   if not m:
+    # exit notices and the second halves of interrupted calls
+    continue
+   name = m.group(1)
+   by_syscall[name] += 1
+   if name in EXEC_SYSCALLS and " = -1 " not in line:
+    path = m.group(2).split('"', 2)[1] if '"' in m.group(2) else "?"
+    execs[os.path.basename(path)] += 1
+
+ forks = sum(by_syscall[i] for i in FORK_SYSCALLS)
+ exec_count = sum(by_syscall[i] for i in EXEC_SYSCALLS)
+ others = ("exit", "exit_group", "wait4", "waitid", "kill", "tgkill", "tkill")
+ file_ops = sum(v for k, v in by_syscall.items()
+                if k not in FORK_SYSCALLS + EXEC_SYSCALLS + others)
+
+ return OrderedDict([
+  ("forks", forks),
+  ("execs", exec_count),
+  ("file_ops", file_ops),
+  ("execs_by_program", OrderedDict(execs.most_common())),
+  ("by_syscall", OrderedDict(sorted(by_syscall.items()))),
+ ])
+
+
+def report(results: Dict[str, Any]) -> None:  #{{{1
+ out = sys.stderr
+ wall = results["wall"]
+ print("startup: p50 %.1f ms, p95 %.1f ms (%d runs%s)"
+       % (wall["p50"] * 1000, wall["p95"] * 1000, wall["n"],
+          ", %d failed" % results["failed"] if results["failed"] else ""),
+       file=out)
+ print("runc invocations: %d (%s)"
+       % (results["runc"]["total"],
+          ", ".join("%s: %d" % i for i in results["runc"]["by_command"].items())),
+       file=out)
+ if "syscalls" in results:
+  sc = results["syscalls"]
+  print("forks: %d, execs: %d, file operations: %d" % (sc["forks"], sc["execs"], sc["file_ops"]),
+        file=out)
+  print("execs by program: %s"
+        % ", ".join("%s: %d" % i for i in sc["execs_by_program"].items()),
+        file=out)
+
+
+if __name__ == "__main__":  #{{{1
+ try:
+  sys.exit(main(sys.argv))
+ except KeyboardInterrupt:
+  pass